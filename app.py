@@ -1,21 +1,51 @@
-from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify
+from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify, g, has_app_context, Response, stream_with_context, stream_template
+from flask.json.provider import DefaultJSONProvider
 import psycopg2
-from psycopg2.extras import RealDictCursor
+from psycopg2.extras import RealDictCursor, Range, Json
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE
 import os
-from datetime import datetime, timedelta
+import threading
+import time
+import uuid
+import shutil
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from bisect import bisect_left, insort
+from collections import deque
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
 from functools import wraps
-from werkzeug.utils import secure_filename
 from werkzeug.security import generate_password_hash, check_password_hash
 import io
-from PIL import Image
+import csv
+import click
+import re
+import zipfile
+import json
+import base64
+import hashlib
+from PIL import Image, ImageOps
 from dotenv import load_dotenv
 from contextlib import contextmanager
 from urllib.parse import urlparse
+from xml.sax.saxutils import escape as xml_escape
 
 # Load environment variables
 load_dotenv()
 
+
+class AppJSONProvider(DefaultJSONProvider):
+    """JSON provider that also understands psycopg2 range values (bookings.rental_period)"""
+
+    @staticmethod
+    def default(o):
+        if isinstance(o, Range):
+            return {'lower': o.lower, 'upper': o.upper}
+        return DefaultJSONProvider.default(o)
+
+
 app = Flask(__name__)
+app.json = AppJSONProvider(app)
 app.secret_key = os.getenv('SECRET_KEY', 'vehiclesrent_v7_ultra_secure_key_2026_production')
 
 # --- CONFIGURATION ---
@@ -75,36 +105,295 @@ if not DB_CONFIG.get('host') or not DB_CONFIG.get('password'):
     print("="*70 + "\n")
 
 # Upload configuration
+UPLOAD_ROOT = 'static/uploads'
 UPLOAD_FOLDER = 'static/uploads/vehicles'
 CUSTOMER_PHOTO_FOLDER = 'static/uploads/customers'
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'webp'}
 MAX_FILE_SIZE = 1 * 1024 * 1024  # 1MB
 
+# Upload image encoding (uploads are downsized before encoding; quality only drops if still over MAX_FILE_SIZE)
+IMAGE_MAX_DIMENSION = int(os.getenv('IMAGE_MAX_DIMENSION', '1600'))
+IMAGE_QUALITY = int(os.getenv('IMAGE_QUALITY', '85'))
+IMAGE_MIN_QUALITY = 40
+IMAGE_PROBE_DIMENSION = 400  # quality search runs on a probe this size, then the full image is encoded once
+IMAGE_PROBE_HEADROOM = 0.9  # probes compress slightly better than the full image
+
+# Responsive derivatives of vehicle images, served through srcset (source width is the cap)
+IMAGE_VARIANT_WIDTHS = (320, 640, 1200)
+IMAGE_VARIANT_FORMATS = {'webp': ('WEBP', 'webp', 78), 'jpeg': ('JPEG', 'jpg', 80)}  # key -> (Pillow format, extension, quality)
+
+# Background image processing (raw uploads are spooled here, then encoded by a per-worker process pool)
+UPLOAD_SPOOL_FOLDER = os.getenv('UPLOAD_SPOOL_FOLDER', 'uploads/spool')
+UPLOAD_HASH_CHUNK_SIZE = 64 * 1024
+UPLOAD_IMMUTABLE_MAX_AGE = 365 * 24 * 3600  # content-addressed upload URLs never change
+
+# Upload storage backend: 'local' (UPLOAD_ROOT on this node) or 's3' (any S3-compatible bucket, needed
+# for more than one instance behind a load balancer)
+STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 'local')
+S3_BUCKET = os.getenv('S3_BUCKET')
+S3_ENDPOINT_URL = os.getenv('S3_ENDPOINT_URL')  # e.g. http://localhost:9000 for MinIO
+S3_REGION = os.getenv('S3_REGION')
+S3_PUBLIC_URL = os.getenv('S3_PUBLIC_URL')  # base URL public objects are read from (bucket or CDN)
+S3_SIGNED_URL_EXPIRY = int(os.getenv('S3_SIGNED_URL_EXPIRY', '3600'))
+
+IMAGE_WORKERS = int(os.getenv('IMAGE_WORKERS', '2'))  # 0 = encode in the request after commit
+
+# Orphaned upload collection (flask gc-uploads): unreferenced files older than the grace period are
+# quarantined, and quarantined files are purged after UPLOAD_QUARANTINE_DAYS
+UPLOAD_GC_GRACE_HOURS = float(os.getenv('UPLOAD_GC_GRACE_HOURS', '24'))
+UPLOAD_QUARANTINE_FOLDER = os.getenv('UPLOAD_QUARANTINE_FOLDER', 'uploads/quarantine')  # local backend only
+UPLOAD_QUARANTINE_DAYS = float(os.getenv('UPLOAD_QUARANTINE_DAYS', '30'))
+UPLOAD_GC_FETCH_SIZE = 5000
+
 # Pagination
 ITEMS_PER_PAGE = 50
 
+# Connection pool configuration (size DB_POOL_MAX against gunicorn workers x threads)
+DB_POOL_MIN = int(os.getenv('DB_POOL_MIN', '1'))
+DB_POOL_MAX = int(os.getenv('DB_POOL_MAX', '5'))
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', '10'))  # seconds to wait for a free connection
+DB_POOL_IDLE_TIMEOUT = float(os.getenv('DB_POOL_IDLE_TIMEOUT', '300'))  # close idle connections after this
+DB_POOL_HEALTHCHECK_INTERVAL = float(os.getenv('DB_POOL_HEALTHCHECK_INTERVAL', '30'))  # ping if idle longer
+
+# Booking numbers reserved per counter update (1 = allocate inside the booking's own transaction)
+BOOKING_NUMBER_BLOCK_SIZE = int(os.getenv('BOOKING_NUMBER_BLOCK_SIZE', '1'))
+
+# In-memory booking interval index (per worker, synced from the booking_changes log)
+BOOKING_INDEX_ENABLED = os.getenv('BOOKING_INDEX_ENABLED', '1') == '1'
+BOOKING_INDEX_SYNC_INTERVAL = float(os.getenv('BOOKING_INDEX_SYNC_INTERVAL', '2'))  # max staleness across workers
+BOOKING_CHANGES_REPLAY_SECONDS = 300  # re-read recent changes to catch late-committing transactions
+BOOKING_CHANGES_RETENTION_HOURS = 24
+
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 os.makedirs(CUSTOMER_PHOTO_FOLDER, exist_ok=True)
+os.makedirs(UPLOAD_SPOOL_FOLDER, exist_ok=True)
+
+
+# --- DATABASE CONNECTION POOL ---
+class PoolTimeoutError(Exception):
+    """Raised when no pooled connection becomes free within DB_POOL_TIMEOUT"""
+
+
+class ConnectionPool:
+    """Thread-safe psycopg2 connection pool with idle reaping, health checks and stats"""
+
+    def __init__(self, connect_kwargs, minconn, maxconn, timeout, idle_timeout, healthcheck_interval):
+        self.connect_kwargs = connect_kwargs
+        self.minconn = minconn
+        self.maxconn = max(maxconn, 1)
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+        self.healthcheck_interval = healthcheck_interval
+
+        self._cond = threading.Condition()
+        self._idle = deque()  # (conn, last_used) - newest on the right
+        self._size = 0        # open connections, idle + in use
+        self._in_use = 0
+        self._waiting = 0
+
+        self._checkouts = 0
+        self._checkout_time_total = 0.0
+        self._checkout_time_max = 0.0
+        self._timeouts = 0
+        self._created = 0
+        self._closed = 0
+        self._healthcheck_failures = 0
+
+    def _close(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+        self._closed += 1
+
+    def _reap_idle(self, now):
+        """Close connections idle longer than idle_timeout, keeping at least minconn open"""
+        while self._idle and self._size > self.minconn:
+            conn, last_used = self._idle[0]
+            if now - last_used < self.idle_timeout:
+                break
+            self._idle.popleft()
+            self._size -= 1
+            self._close(conn)
+
+    def _is_healthy(self, conn, last_used):
+        if conn.closed:
+            return False
+        if time.monotonic() - last_used < self.healthcheck_interval:
+            return True
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute('SELECT 1')
+            conn.rollback()
+            return True
+        except Exception:
+            with self._cond:
+                self._healthcheck_failures += 1
+            return False
+
+    def getconn(self):
+        """Check out a connection, waiting up to timeout seconds for one to free up"""
+        started = time.monotonic()
+        deadline = started + self.timeout
+
+        while True:
+            conn = last_used = None
+            with self._cond:
+                while True:
+                    self._reap_idle(time.monotonic())
+                    if self._idle:
+                        conn, last_used = self._idle.pop()
+                        self._in_use += 1
+                        break
+                    if self._size < self.maxconn:
+                        self._size += 1
+                        self._in_use += 1
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._timeouts += 1
+                        raise PoolTimeoutError(
+                            f"No database connection available after {self.timeout}s "
+                            f"(pool max {self.maxconn}, in use {self._in_use})")
+                    self._waiting += 1
+                    try:
+                        self._cond.wait(remaining)
+                    finally:
+                        self._waiting -= 1
+
+            # Connect / ping outside the lock so other threads are not blocked on the network
+            if conn is None:
+                try:
+                    conn = psycopg2.connect(**self.connect_kwargs)
+                except Exception:
+                    with self._cond:
+                        self._size -= 1
+                        self._in_use -= 1
+                        self._cond.notify()
+                    raise
+                with self._cond:
+                    self._created += 1
+            elif not self._is_healthy(conn, last_used):
+                with self._cond:
+                    self._size -= 1
+                    self._in_use -= 1
+                    self._close(conn)
+                    self._cond.notify()
+                continue
+
+            elapsed = time.monotonic() - started
+            with self._cond:
+                self._checkouts += 1
+                self._checkout_time_total += elapsed
+                self._checkout_time_max = max(self._checkout_time_max, elapsed)
+            return conn
+
+    def putconn(self, conn, discard=False):
+        """Return a connection to the pool, rolling back any transaction left open"""
+        if not discard and not conn.closed:
+            try:
+                if conn.get_transaction_status() != TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except Exception:
+                discard = True
+
+        with self._cond:
+            self._in_use -= 1
+            if discard or conn.closed:
+                self._size -= 1
+                self._close(conn)
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._reap_idle(time.monotonic())
+            self._cond.notify()
+
+    def closeall(self):
+        with self._cond:
+            while self._idle:
+                conn, _ = self._idle.pop()
+                self._size -= 1
+                self._close(conn)
+
+    def stats(self):
+        with self._cond:
+            checkouts = self._checkouts
+            return {
+                'pid': os.getpid(),
+                'min_size': self.minconn,
+                'max_size': self.maxconn,
+                'size': self._size,
+                'idle': len(self._idle),
+                'in_use': self._in_use,
+                'waiting': self._waiting,
+                'checkouts': checkouts,
+                'checkout_avg_ms': round(self._checkout_time_total / checkouts * 1000, 3) if checkouts else 0.0,
+                'checkout_max_ms': round(self._checkout_time_max * 1000, 3),
+                'timeouts': self._timeouts,
+                'connections_created': self._created,
+                'connections_closed': self._closed,
+                'healthcheck_failures': self._healthcheck_failures,
+            }
+
+
+_db_pool = None
+_db_pool_pid = None
+_db_pool_lock = threading.Lock()
+
+
+def get_db_pool():
+    """Return this process's pool, creating it lazily (gunicorn forks after import)"""
+    global _db_pool, _db_pool_pid
+    if _db_pool is None or _db_pool_pid != os.getpid():
+        with _db_pool_lock:
+            if _db_pool is None or _db_pool_pid != os.getpid():
+                _db_pool = ConnectionPool(DB_CONFIG, DB_POOL_MIN, DB_POOL_MAX, DB_POOL_TIMEOUT,
+                                          DB_POOL_IDLE_TIMEOUT, DB_POOL_HEALTHCHECK_INTERVAL)
+                _db_pool_pid = os.getpid()
+    return _db_pool
 
 
 # --- DATABASE CONNECTION ---
 @contextmanager
-def get_db_connection():
-    """Context manager for database connections"""
+def get_db_connection(request_scoped=True):
+    """Context manager for database connections.
+
+    Inside an app/request context the connection is checked out once and bound to
+    flask.g, so every block in the request shares it. Nested blocks join the outer
+    transaction; only the outermost block commits or rolls back. Pass
+    request_scoped=False for out-of-band work that must not share the request's
+    transaction.
+    """
+    scoped = request_scoped and has_app_context()
     conn = None
     try:
         # Ensure we have required config before attempting connection
         if not DB_CONFIG.get('host'):
             raise ValueError("Database host not configured. Please set DATABASE_URL or SUPABASE_HOST")
         
-        conn = psycopg2.connect(**DB_CONFIG)
+        if scoped:
+            conn = g.get('_db_conn')
+            if conn is None:
+                conn = get_db_pool().getconn()
+                g._db_conn = conn
+                g._db_depth = 0
+            outermost = g._db_depth == 0
+            g._db_depth += 1
+        else:
+            conn = get_db_pool().getconn()
+            outermost = True
+        
         try:
             yield conn
-            conn.commit()
+            if outermost:
+                conn.commit()
         except Exception as e:
-            conn.rollback()
-            print(f"❌ Database error: {e}")
+            if outermost:
+                conn.rollback()
+                print(f"❌ Database error: {e}")
             raise e
+        finally:
+            if scoped:
+                g._db_depth -= 1
     except psycopg2.OperationalError as e:
         print(f"\n❌ Database connection failed!")
         print(f"Error: {e}")
@@ -119,8 +408,17 @@ def get_db_connection():
         print(f"\n❌ Configuration error: {e}")
         raise
     finally:
-        if conn:
-            conn.close()
+        if conn is not None and not scoped:
+            get_db_pool().putconn(conn)
+
+
+@app.teardown_appcontext
+def release_db_connection(exc):
+    """Return the request-scoped connection to the pool"""
+    conn = g.pop('_db_conn', None)
+    g.pop('_db_depth', None)
+    if conn is not None:
+        get_db_pool().putconn(conn, discard=conn.closed != 0)
 
 
 def get_db_cursor(conn):
@@ -128,51 +426,1098 @@ def get_db_cursor(conn):
     return conn.cursor(cursor_factory=RealDictCursor)
 
 
+# --- UPLOAD STORAGE ---
+class LocalStorage:
+    """Uploads kept under a local directory and served by Flask's static route (single node only)"""
+
+    def __init__(self, root, base_url, quarantine_root):
+        self.root = root
+        self.base_url = base_url.rstrip('/')
+        self.quarantine_root = quarantine_root
+
+    def _path(self, key, root=None):
+        return os.path.join(root or self.root, *key.split('/'))
+
+    def _prune(self, key, root=None):
+        """Remove directories left empty above key, keeping the top-level folder.
+
+        Only used in the quarantine tree: uploads may be writing into a shard directory of the live one.
+        """
+        parts = key.split('/')[:-1]
+        while len(parts) > 1:
+            try:
+                os.rmdir(self._path('/'.join(parts), root))
+            except OSError:
+                break
+            parts.pop()
+
+    def _scan(self, prefix, root=None):
+        stack = [prefix]
+        while stack:
+            directory = stack.pop()
+            try:
+                with os.scandir(self._path(directory, root)) as entries:
+                    for entry in entries:
+                        if entry.name.startswith('.'):
+                            continue  # .gitkeep and the like
+                        key = f"{directory}/{entry.name}"
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(key)
+                        elif entry.is_file(follow_symlinks=False):
+                            stat = entry.stat(follow_symlinks=False)
+                            yield key, stat.st_size, stat.st_mtime
+            except OSError:
+                continue
+
+    def exists(self, key):
+        return os.path.isfile(self._path(key))
+
+    def read(self, key):
+        with open(self._path(key), 'rb') as f:
+            return f.read()
+
+    def save(self, key, data, content_type):
+        # Written under a temporary name and renamed, so a stored object is never seen half-written
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, path)
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+    def delete_prefix(self, prefix):
+        shutil.rmtree(self._path(prefix), ignore_errors=True)
+
+    def walk(self, prefix):
+        """(key, size, modified timestamp) for every object under prefix/"""
+        return self._scan(prefix)
+
+    def quarantine(self, key):
+        """Move an object out of the served tree; its timestamp becomes the quarantine time"""
+        target = self._path(key, self.quarantine_root)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        shutil.move(self._path(key), target)
+        os.utime(target)
+
+    def walk_quarantine(self):
+        for top in os.listdir(self.quarantine_root) if os.path.isdir(self.quarantine_root) else []:
+            yield from self._scan(top, self.quarantine_root)
+
+    def delete_quarantined(self, key):
+        try:
+            os.remove(self._path(key, self.quarantine_root))
+        except OSError:
+            pass
+        self._prune(key, self.quarantine_root)
+
+    def list(self, prefix):
+        """Keys of the objects directly under prefix/"""
+        try:
+            with os.scandir(self._path(prefix)) as entries:
+                return [f"{prefix}/{entry.name}" for entry in entries if entry.is_file()]
+        except OSError:
+            return []
+
+    def url(self, key, private=False):
+        return f"{self.base_url}/{key}"
+
+    def signed_url(self, key):
+        return self.url(key)
+
+    def key_for_url(self, url):
+        prefix = f"{self.base_url}/"
+        return url[len(prefix):] if url and url.startswith(prefix) else None
+
+
+class S3Storage:
+    """Uploads kept in an S3-compatible bucket (AWS S3, MinIO, R2, ...) and served straight from it.
+
+    Public objects are linked at S3_PUBLIC_URL (the bucket policy or CDN must allow reads);
+    private ones go through /uploads/files/<key>, which redirects to a short-lived signed URL.
+    Credentials come from the usual AWS_* environment variables.
+    """
+
+    def __init__(self, bucket, endpoint_url=None, region=None, public_url=None, signed_url_expiry=3600):
+        import boto3
+        from botocore.exceptions import ClientError
+        
+        self.client = boto3.client('s3', endpoint_url=endpoint_url, region_name=region)
+        self.bucket = bucket
+        if not public_url:
+            public_url = f"{endpoint_url.rstrip('/')}/{bucket}" if endpoint_url else f"https://{bucket}.s3.amazonaws.com"
+        self.public_url = public_url.rstrip('/')
+        self.signed_url_expiry = signed_url_expiry
+        self._client_error = ClientError
+
+    def exists(self, key):
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=key)
+            return True
+        except self._client_error as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                return False
+            raise
+
+    def read(self, key):
+        return self.client.get_object(Bucket=self.bucket, Key=key)['Body'].read()
+
+    def save(self, key, data, content_type):
+        self.client.put_object(Bucket=self.bucket, Key=key, Body=data, ContentType=content_type,
+                               CacheControl=f"max-age={UPLOAD_IMMUTABLE_MAX_AGE}, immutable")
+
+    def delete(self, key):
+        self.client.delete_object(Bucket=self.bucket, Key=key)
+
+    def delete_prefix(self, prefix):
+        keys = [{'Key': key} for key in self._iter_keys(f"{prefix}/")]
+        for start in range(0, len(keys), 1000):
+            self.client.delete_objects(Bucket=self.bucket, Delete={'Objects': keys[start:start + 1000], 'Quiet': True})
+
+    def list(self, prefix):
+        """Keys of the objects directly under prefix/"""
+        return list(self._iter_keys(f"{prefix}/", delimiter='/'))
+
+    def walk(self, prefix):
+        """(key, size, modified timestamp) for every object under prefix/"""
+        for item in self._iter_objects(f"{prefix}/"):
+            yield item['Key'], item['Size'], item['LastModified'].timestamp()
+
+    def quarantine(self, key):
+        """Copy an object under quarantine/ (keep that prefix private) and delete the original"""
+        self.client.copy_object(Bucket=self.bucket, Key=f"quarantine/{key}",
+                                CopySource={'Bucket': self.bucket, 'Key': key})
+        self.delete(key)
+
+    def walk_quarantine(self):
+        return self.walk('quarantine')
+
+    def delete_quarantined(self, key):
+        self.delete(key)
+
+    def _iter_keys(self, prefix, delimiter=''):
+        for item in self._iter_objects(prefix, delimiter):
+            yield item['Key']
+
+    def _iter_objects(self, prefix, delimiter=''):
+        paginator = self.client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=prefix, Delimiter=delimiter):
+            yield from page.get('Contents', [])
+
+    def url(self, key, private=False):
+        return f"/uploads/files/{key}" if private else f"{self.public_url}/{key}"
+
+    def signed_url(self, key):
+        return self.client.generate_presigned_url('get_object', Params={'Bucket': self.bucket, 'Key': key},
+                                                  ExpiresIn=self.signed_url_expiry)
+
+    def key_for_url(self, url):
+        for prefix in (f"{self.public_url}/", '/uploads/files/'):
+            if url and url.startswith(prefix):
+                return url[len(prefix):]
+        return None
+
+
+_upload_storage = None
+_upload_storage_lock = threading.Lock()
+
+
+def get_upload_storage():
+    """Storage backend selected by STORAGE_BACKEND, created once per process"""
+    global _upload_storage
+    with _upload_storage_lock:
+        if _upload_storage is None:
+            if STORAGE_BACKEND == 's3':
+                if not S3_BUCKET:
+                    raise ValueError("STORAGE_BACKEND=s3 requires S3_BUCKET")
+                _upload_storage = S3Storage(S3_BUCKET, endpoint_url=S3_ENDPOINT_URL, region=S3_REGION,
+                                            public_url=S3_PUBLIC_URL, signed_url_expiry=S3_SIGNED_URL_EXPIRY)
+            elif STORAGE_BACKEND == 'local':
+                _upload_storage = LocalStorage(UPLOAD_ROOT, '/' + UPLOAD_ROOT, UPLOAD_QUARANTINE_FOLDER)
+            else:
+                raise ValueError(f"Unknown STORAGE_BACKEND: {STORAGE_BACKEND}")
+        return _upload_storage
+
+
 # --- FILE UPLOAD HELPERS ---
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
 
-def compress_and_save_image(file, filename, folder=UPLOAD_FOLDER):
-    """Compress image to ensure it's under 1MB and save it"""
+# Output mode -> source modes whose embedded ICC profile still describes the flattened pixels
+ICC_PROFILE_SOURCE_MODES = {'RGB': ('RGB', 'RGBA', 'P'), 'L': ('L',)}
+
+
+def flatten_for_jpeg(img):
+    """Composite transparency onto white and normalise the mode for JPEG"""
+    if img.mode == 'P':
+        img = img.convert('RGBA' if 'transparency' in img.info else 'RGB')
+    if img.mode in ('RGBA', 'LA'):
+        background = Image.new('RGB', img.size, (255, 255, 255))
+        background.paste(img, mask=img.getchannel('A'))
+        return background
+    if img.mode not in ('RGB', 'L'):
+        return img.convert('RGB')
+    return img
+
+
+def encode_jpeg(img, quality, icc_profile=None):
+    buffer = io.BytesIO()
+    img.save(buffer, format='JPEG', quality=quality, progressive=True, icc_profile=icc_profile)
+    return buffer
+
+
+def search_jpeg_quality(img, budget):
+    """Highest quality in [IMAGE_MIN_QUALITY, IMAGE_QUALITY) whose encode of img fits in budget bytes"""
+    low, high, best = IMAGE_MIN_QUALITY, IMAGE_QUALITY - 1, IMAGE_MIN_QUALITY
+    while low <= high:
+        quality = (low + high) // 2
+        if encode_jpeg(img, quality).tell() <= budget:
+            best, low = quality, quality + 1
+        else:
+            high = quality - 1
+    return best
+
+
+def compress_and_save_image(file, key, with_variants=False):
+    """Downsize, orient and encode an upload as a JPEG under MAX_FILE_SIZE, then store it at key.
+
+    The image is shrunk to IMAGE_MAX_DIMENSION before any encoding (JPEG sources are
+    decoded at reduced scale via draft mode), rotated according to its EXIF orientation
+    and written without EXIF metadata. Most photos fit at IMAGE_QUALITY on the first
+    encode; otherwise the quality is chosen by binary search on a small probe and the
+    full image is encoded once more. Variants, if requested, are stored before the main
+    object, so an existing key always has its full set.
+    """
+    started = time.perf_counter()
     try:
         img = Image.open(file)
+        img.draft('RGB', (IMAGE_MAX_DIMENSION, IMAGE_MAX_DIMENSION))
+        icc_profile, source_mode = img.info.get('icc_profile'), img.mode
+        img = ImageOps.exif_transpose(img)
+        img.thumbnail((IMAGE_MAX_DIMENSION, IMAGE_MAX_DIMENSION), Image.Resampling.LANCZOS)
+        img = flatten_for_jpeg(img)
+        if source_mode not in ICC_PROFILE_SOURCE_MODES[img.mode]:
+            # The profile describes the source colour space (e.g. CMYK), not the converted pixels
+            icc_profile = None
+
+        quality = IMAGE_QUALITY
+        buffer = encode_jpeg(img, quality, icc_profile)
+        encodes = 1
+        if buffer.tell() > MAX_FILE_SIZE:
+            probe = img.copy()
+            probe.thumbnail((IMAGE_PROBE_DIMENSION, IMAGE_PROBE_DIMENSION), Image.Resampling.BILINEAR)
+            scale = (probe.width * probe.height) / (img.width * img.height)
+            quality = search_jpeg_quality(probe, MAX_FILE_SIZE * scale * IMAGE_PROBE_HEADROOM)
+            buffer = encode_jpeg(img, quality, icc_profile)
+            encodes += 1
+        while buffer.tell() > MAX_FILE_SIZE:
+            # The probe under-estimated, or even the lowest quality is too large: shrink instead
+            img = img.resize((img.width * 3 // 4, img.height * 3 // 4), Image.Resampling.LANCZOS)
+            buffer = encode_jpeg(img, quality, icc_profile)
+            encodes += 1
+
+        if with_variants:
+            save_image_variants(img, key)
+        get_upload_storage().save(key, buffer.getvalue(), 'image/jpeg')
+
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        print(f"🖼️  Encoded {key}: {img.width}x{img.height} q{quality}, "
+              f"{buffer.tell() // 1024}KB, {encodes} encode(s) in {elapsed_ms:.0f}ms")
+        return key
         
-        if img.mode in ('RGBA', 'LA', 'P'):
-            background = Image.new('RGB', img.size, (255, 255, 255))
-            background.paste(img, mask=img.split()[-1] if img.mode == 'RGBA' else None)
-            img = background
-        
-        quality = 90
-        while quality > 20:
+    except Exception as e:
+        print(f"Error compressing image: {e}")
+        return None
+
+
+def image_variants_prefix(key):
+    """Storage prefix holding the derivatives of a stored upload (<dir>/variants/<stem>)"""
+    directory, _, filename = key.rpartition('/')
+    return f"{directory}/variants/{os.path.splitext(filename)[0]}"
+
+
+def save_image_variants(img, key):
+    """Store IMAGE_VARIANT_WIDTHS derivatives of img in every IMAGE_VARIANT_FORMATS format.
+
+    Widths wider than the source collapse to the source width.
+    """
+    storage = get_upload_storage()
+    prefix = image_variants_prefix(key)
+    source_width, source_height = img.size
+    # Largest first, so each width is resized from the previous one instead of the full source
+    for width in sorted({min(width, source_width) for width in IMAGE_VARIANT_WIDTHS}, reverse=True):
+        img = img.resize((width, max(1, round(source_height * width / source_width))), Image.Resampling.LANCZOS)
+        for image_format, extension, quality in IMAGE_VARIANT_FORMATS.values():
             buffer = io.BytesIO()
-            img.save(buffer, format='JPEG', quality=quality, optimize=True)
-            size = buffer.tell()
-            
-            if size <= MAX_FILE_SIZE:
-                filepath = os.path.join(folder, filename)
-                with open(filepath, 'wb') as f:
-                    f.write(buffer.getvalue())
-                return filepath
-            
-            quality -= 10
-        
-        img.thumbnail((1200, 1200), Image.Resampling.LANCZOS)
-        buffer = io.BytesIO()
-        img.save(buffer, format='JPEG', quality=85, optimize=True)
+            img.save(buffer, format=image_format, quality=quality)
+            storage.save(f"{prefix}/{width}.{extension}", buffer.getvalue(), f"image/{image_format.lower()}")
+
+
+def image_variant_srcsets(key):
+    """{format: srcset} for the variants stored for key, or None if there are none"""
+    storage = get_upload_storage()
+    names = [variant_key.rpartition('/')[2] for variant_key in storage.list(image_variants_prefix(key))]
+    
+    srcsets = {}
+    for name, (_, extension, _) in IMAGE_VARIANT_FORMATS.items():
+        widths = sorted(int(n.split('.')[0]) for n in names if n.endswith(f".{extension}"))
+        if not widths:
+            return None
+        srcsets[name] = ', '.join(
+            f"{storage.url(f'{image_variants_prefix(key)}/{width}.{extension}')} {width}w" for width in widths)
+    return srcsets
+
+
+# --- BACKGROUND IMAGE JOBS ---
+# kind -> (table, image column, srcset column or None, storage key prefix, private)
+IMAGE_JOB_TARGETS = {
+    'vehicle': ('vehicles', 'image_url', 'image_variants', 'vehicles', False),
+    'customer': ('bookings', 'customer_photo', None, 'customers', True),
+}
+
+IMAGE_PLACEHOLDER_SVG = (
+    '<svg xmlns="http://www.w3.org/2000/svg" width="400" height="300" viewBox="0 0 400 300">'
+    '<rect width="400" height="300" fill="#e5e7eb"/>'
+    '<text x="200" y="155" font-family="sans-serif" font-size="18" fill="#6b7280" '
+    'text-anchor="middle">Processing image...</text></svg>'
+)
+
+_image_pool = None
+_image_pool_lock = threading.Lock()
+
+
+def get_image_pool():
+    """Per-worker process pool for image encoding, created on first use (after gunicorn forks)"""
+    global _image_pool
+    with _image_pool_lock:
+        if _image_pool is None:
+            _image_pool = ProcessPoolExecutor(max_workers=IMAGE_WORKERS,
+                                              mp_context=multiprocessing.get_context('spawn'))
+        return _image_pool
+
+
+def reset_image_pool():
+    """Drop a broken pool so the next job starts a fresh one"""
+    global _image_pool
+    with _image_pool_lock:
+        pool, _image_pool = _image_pool, None
+    if pool is not None:
+        pool.shutdown(wait=False)
+
+
+def image_job_placeholder(job_id):
+    """URL stored on the target row while the job is pending"""
+    return f"/uploads/jobs/{job_id}/image"
+
+
+def spool_upload(file):
+    """Copy an upload to the spool folder, returning (spool path, content-addressed file name).
+
+    Stored files are named by the SHA-256 of the uploaded bytes and sharded two levels deep
+    (ab/cd/abcd...jpg), so the same upload always maps to the same immutable file.
+    """
+    digest = hashlib.sha256()
+    spool_path = os.path.join(UPLOAD_SPOOL_FOLDER, uuid.uuid4().hex)
+    with open(spool_path, 'wb') as spool:
+        for chunk in iter(lambda: file.stream.read(UPLOAD_HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+            spool.write(chunk)
+    key = digest.hexdigest()
+    return spool_path, f"{key[:2]}/{key[2:4]}/{key}.jpg"
+
+
+def lock_upload(cursor, url):
+    """Serialise publishing and releasing of one stored file until the transaction ends"""
+    cursor.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", (url,))
+
+
+def release_upload(url):
+    """Delete a stored upload (and its variants) once no vehicle or booking references it.
+
+    Reference counts are kept in upload_objects by triggers, so call this after the
+    transaction that dropped the reference has committed. Returns True if it was deleted.
+    """
+    storage = get_upload_storage()
+    key = storage.key_for_url(url)
+    if not key:
+        return False
+    with get_db_connection(request_scoped=False) as conn:
+        cursor = get_db_cursor(conn)
+        lock_upload(cursor, url)
+        cursor.execute("SELECT refs FROM upload_objects WHERE url = %s", (url,))
+        row = cursor.fetchone()
+        if row and row['refs'] > 0:
+            return False
         
-        filepath = os.path.join(folder, filename)
-        with open(filepath, 'wb') as f:
-            f.write(buffer.getvalue())
+        storage.delete(key)
+        storage.delete_prefix(image_variants_prefix(key))
+        cursor.execute("DELETE FROM upload_objects WHERE url = %s", (url,))
+    return True
+
+
+def backfill_upload_refs(cursor):
+    """Recount upload_objects from vehicles and bookings; returns the number of stored files"""
+    cursor.execute("LOCK TABLE vehicles, bookings IN SHARE MODE")
+    cursor.execute("TRUNCATE upload_objects")
+    cursor.execute('''INSERT INTO upload_objects (url, refs)
+        SELECT url, COUNT(*) FROM (
+            SELECT image_url AS url FROM vehicles
+            UNION ALL
+            SELECT customer_photo FROM bookings
+        ) refs
+        WHERE url <> '' AND url NOT LIKE '/uploads/jobs/%'
+        GROUP BY url''')
+    return cursor.rowcount
+
+
+def iter_upload_references(fetch_size=UPLOAD_GC_FETCH_SIZE):
+    """Yield the storage key of every upload still needed by a vehicle, booking or pending image job.
+
+    Streams from a named (server-side) cursor, so memory stays flat however many rows there are.
+    """
+    storage = get_upload_storage()
+    with get_db_connection(request_scoped=False) as conn:
+        cursor = conn.cursor(name='upload_refs_stream', cursor_factory=RealDictCursor)
+        cursor.itersize = fetch_size
+        try:
+            cursor.execute('''
+                SELECT image_url AS url, NULL AS kind, NULL AS filename FROM vehicles
+                UNION ALL
+                SELECT customer_photo, NULL, NULL FROM bookings
+                UNION ALL
+                SELECT replaces_url, kind, filename FROM image_jobs WHERE status = 'pending'
+            ''')
+            for row in cursor:
+                key = storage.key_for_url(row['url'])
+                if key:
+                    yield key
+                if row['kind'] in IMAGE_JOB_TARGETS:
+                    yield f"{IMAGE_JOB_TARGETS[row['kind']][3]}/{row['filename']}"
+        finally:
+            cursor.close()
+
+
+def upload_still_unreferenced(cursor, kind, key, url):
+    """Recheck a collection candidate; call while holding lock_upload(cursor, url)"""
+    cursor.execute("SELECT refs FROM upload_objects WHERE url = %s", (url,))
+    row = cursor.fetchone()
+    if row and row['refs'] > 0:
+        return False
+    prefix = IMAGE_JOB_TARGETS[kind][3]
+    cursor.execute('''SELECT 1 FROM image_jobs WHERE status = 'pending'
+        AND (replaces_url = %s OR (kind = %s AND filename = %s)) LIMIT 1''',
+        (url, kind, key[len(prefix) + 1:]))
+    return cursor.fetchone() is None
+
+
+def collect_upload_garbage(grace_hours=UPLOAD_GC_GRACE_HOURS, action='quarantine'):
+    """Find stored uploads nothing references any more and quarantine or delete them.
+
+    Files younger than grace_hours are left alone (an upload may still be publishing), and each
+    candidate is rechecked under its upload lock before it is touched. action is 'quarantine',
+    'delete' or None for a report only. Returns per-folder usage and what was (or would be) reclaimed.
+    """
+    storage = get_upload_storage()
+    referenced = set(iter_upload_references())
+    referenced_variants = {image_variants_prefix(key) for key in referenced}
+    now = time.time()
+    cutoff = now - grace_hours * 3600
+    
+    folders = {}
+    orphans = {}  # key -> (kind, size)
+    orphan_variants = {}  # variants prefix -> [(key, size)]
+    recent = {'files': 0, 'bytes': 0}
+    recent_variants = set()
+    for kind, target in IMAGE_JOB_TARGETS.items():
+        prefix = target[3]
+        for key, size, modified in storage.walk(prefix):
+            directory = key.rpartition('/')[0]
+            is_variant = '/variants/' in key
+            usage = folders.setdefault(f"{prefix}/variants" if is_variant else prefix, {'files': 0, 'bytes': 0})
+            usage['files'] += 1
+            usage['bytes'] += size
+            if (directory in referenced_variants) if is_variant else (key in referenced):
+                continue
+            if modified > cutoff:
+                recent['files'] += 1
+                recent['bytes'] += size
+                if not is_variant:
+                    recent_variants.add(image_variants_prefix(key))
+            elif is_variant:
+                orphan_variants.setdefault(directory, []).append((key, size))
+            else:
+                orphans[key] = (kind, size)
+    
+    dispose = {'quarantine': storage.quarantine, 'delete': storage.delete}.get(action)
+    reclaimed = {'files': 0, 'bytes': 0}
+    
+    def reclaim(key, size):
+        if dispose:
+            try:
+                dispose(key)
+            except Exception as e:
+                print(f"⚠️  Could not {action} {key}: {e}")
+                return
+        reclaimed['files'] += 1
+        reclaimed['bytes'] += size
+    
+    with get_db_connection(request_scoped=False) as conn:
+        cursor = get_db_cursor(conn)
+        for key, (kind, size) in orphans.items():
+            url = storage.url(key, IMAGE_JOB_TARGETS[kind][4])
+            lock_upload(cursor, url)
+            if upload_still_unreferenced(cursor, kind, key, url):
+                reclaim(key, size)
+                for variant_key, variant_size in orphan_variants.pop(image_variants_prefix(key), []):
+                    reclaim(variant_key, variant_size)
+                if dispose:
+                    cursor.execute("DELETE FROM upload_objects WHERE url = %s AND refs = 0", (url,))
+            else:
+                orphan_variants.pop(image_variants_prefix(key), None)
+            conn.commit()  # releases the upload lock
+    
+    # Variants whose original is gone entirely
+    for directory, variants in orphan_variants.items():
+        if directory not in recent_variants:
+            for variant_key, variant_size in variants:
+                reclaim(variant_key, variant_size)
+    
+    quarantine = {'files': 0, 'bytes': 0, 'purged_files': 0, 'purged_bytes': 0}
+    purge_before = now - UPLOAD_QUARANTINE_DAYS * 86400
+    for key, size, modified in storage.walk_quarantine():
+        if action and modified < purge_before:
+            storage.delete_quarantined(key)
+            quarantine['purged_files'] += 1
+            quarantine['purged_bytes'] += size
+        else:
+            quarantine['files'] += 1
+            quarantine['bytes'] += size
+    
+    return {
+        'folders': folders,
+        'recent': recent,
+        'reclaimed': reclaimed,
+        'quarantine': quarantine,
+        'spool': collect_spool_garbage(cutoff, remove=bool(action)),
+        'action': action,
+        'grace_hours': grace_hours,
+    }
+
+
+def collect_spool_garbage(cutoff, remove=True):
+    """Drop spooled uploads older than cutoff that no pending image job will read (this node only)"""
+    with get_db_connection(request_scoped=False) as conn:
+        cursor = get_db_cursor(conn)
+        cursor.execute("SELECT spool_path FROM image_jobs WHERE status = 'pending'")
+        pending = {os.path.normpath(row['spool_path']) for row in cursor.fetchall()}
+    
+    spool = {'files': 0, 'bytes': 0}
+    try:
+        entries = list(os.scandir(UPLOAD_SPOOL_FOLDER))
+    except OSError:
+        return spool
+    for entry in entries:
+        if not entry.is_file(follow_symlinks=False) or os.path.normpath(entry.path) in pending:
+            continue
+        stat = entry.stat(follow_symlinks=False)
+        if stat.st_mtime < cutoff:
+            if remove:
+                try:
+                    os.remove(entry.path)
+                except OSError:
+                    continue
+            spool['files'] += 1
+            spool['bytes'] += stat.st_size
+    return spool
+
+
+def queue_image_job(cursor, kind, target_id, file, replaces_url=None):
+    """Spool an upload to disk, record a pending job and point the target row at its placeholder.
+
+    All of this happens in the current transaction; call start_image_job(job) once it has
+    committed. replaces_url is only released after the new file is published.
+    """
+    table, column, variants_column = IMAGE_JOB_TARGETS[kind][:3]
+    spool_path, filename = spool_upload(file)
+    cursor.execute('''INSERT INTO image_jobs (kind, target_id, spool_path, filename, replaces_url)
+        VALUES (%s, %s, %s, %s, %s) RETURNING id''',
+        (kind, target_id, spool_path, filename, replaces_url))
+    job_id = cursor.fetchone()['id']
+    assignments = f"{column} = %s" + (f", {variants_column} = NULL" if variants_column else "")
+    cursor.execute(f"UPDATE {table} SET {assignments} WHERE id = %s", (image_job_placeholder(job_id), target_id))
+    return {'id': job_id, 'kind': kind, 'spool_path': spool_path, 'filename': filename,
+            'placeholder': image_job_placeholder(job_id)}
+
+
+def process_image_upload(spool_path, kind, filename):
+    """Pool task: encode a spooled upload (plus its variants, if kind has them) and drop the spool file.
+
+    Content already in the store is reused as-is, so a duplicate upload costs no encoding.
+    Returns {'key': storage key, 'variants': {format: srcset} or None}, or None on failure.
+    """
+    variants_column, prefix = IMAGE_JOB_TARGETS[kind][2:4]
+    key = f"{prefix}/{filename}"
+    try:
+        if get_upload_storage().exists(key):
+            print(f"🖼️  Reusing stored {key}")
+        elif not compress_and_save_image(spool_path, key, with_variants=bool(variants_column)):
+            return None
+        return {'key': key, 'variants': image_variant_srcsets(key) if variants_column else None}
+    finally:
+        if os.path.exists(spool_path):
+            os.remove(spool_path)
+
+
+def start_image_job(job):
+    """Hand a committed job to the pool (or encode it inline when IMAGE_WORKERS is 0)"""
+    if IMAGE_WORKERS > 0:
+        try:
+            future = get_image_pool().submit(process_image_upload, job['spool_path'], job['kind'], job['filename'])
+            future.add_done_callback(lambda f: _image_job_done(job['id'], f))
+            return
+        except RuntimeError as e:
+            # BrokenProcessPool (a child died) or a pool shut down at exit
+            print(f"⚠️  Image pool unavailable, encoding inline: {e}")
+            reset_image_pool()
+    run_image_job(job)
+
+
+def run_image_job(job):
+    """Encode a job in this process and publish the result"""
+    result = process_image_upload(job['spool_path'], job['kind'], job['filename'])
+    finish_image_job(job['id'], result, None if result else 'Image could not be processed')
+
+
+def _image_job_done(job_id, future):
+    try:
+        result = future.result()
+        error = None if result else 'Image could not be processed'
+    except Exception as e:
+        result, error = None, str(e) or e.__class__.__name__
+    try:
+        finish_image_job(job_id, result, error)
+    except Exception as e:
+        print(f"⚠️  Image job {job_id} could not be finished: {e}")
+
+
+def finish_image_job(job_id, result, error=None):
+    """Publish a job's result: swap the placeholder for the new file, or back to the old one.
+
+    The swap only applies while the row still holds this job's placeholder, so a row that was
+    deleted or given another image in the meantime keeps what it has and the new file is dropped.
+    """
+    with get_db_connection(request_scoped=False) as conn:
+        cursor = get_db_cursor(conn)
+        cursor.execute("SELECT * FROM image_jobs WHERE id = %s FOR UPDATE", (job_id,))
+        job = cursor.fetchone()
+        if not job or job['status'] != 'pending':
+            return
         
-        return filepath
+        table, column, variants_column, prefix, private = IMAGE_JOB_TARGETS[job['kind']]
+        storage = get_upload_storage()
+        new_url = storage.url(f"{prefix}/{job['filename']}", private)
+        image_url = new_url if result else None
+        if image_url:
+            # The same content may be being released by another row right now
+            lock_upload(cursor, image_url)
+            if not storage.exists(result['key']):
+                result, image_url, error = None, None, 'Stored file was removed before publishing'
+        values = {column: image_url or job['replaces_url']}
+        if variants_column:
+            # A restored previous image goes back without variants until rebuilt
+            values[variants_column] = Json(result['variants']) if result and result['variants'] else None
+        assignments = ', '.join(f"{name} = %s" for name in values)
+        cursor.execute(f"UPDATE {table} SET {assignments} WHERE id = %s AND {column} = %s",
+                       (*values.values(), job['target_id'], image_job_placeholder(job_id)))
+        published = cursor.rowcount > 0
         
-    except Exception as e:
-        print(f"Error compressing image: {e}")
-        return None
+        if not result:
+            status = 'failed'
+        elif published:
+            status = 'done'
+        else:
+            status, image_url = 'superseded', None
+        cursor.execute('''UPDATE image_jobs SET status = %s, image_url = %s, error = %s,
+            finished_at = CURRENT_TIMESTAMP WHERE id = %s''', (status, image_url, error, job_id))
+    
+    # Files are only released once the swap has committed
+    if status == 'done':
+        release_upload(job['replaces_url'])
+    elif status == 'superseded':
+        release_upload(new_url)
+    
+    if published:
+        if job['kind'] == 'vehicle':
+            on_vehicles_changed()
+        else:
+            on_bookings_changed()
 
 
 # --- DATABASE INITIALIZATION ---
+BOOKING_PERIOD_FUNCTIONS_SQL = """
+    CREATE OR REPLACE FUNCTION booking_period(p_start_date TEXT, p_pickup_time TEXT,
+                                              p_end_date TEXT, p_return_time TEXT)
+    RETURNS TSRANGE AS $$
+    DECLARE
+        v_start TIMESTAMP;
+        v_end TIMESTAMP;
+    BEGIN
+        -- Malformed dates/times raise (invalid_datetime_format) rather than leaving the period NULL,
+        -- which would slip past bookings_no_overlap and every rental_period query
+        v_start := (p_start_date || ' ' || p_pickup_time)::timestamp;
+        v_end := (p_end_date || ' ' || p_return_time)::timestamp;
+        -- A zero-length period is an empty range, which && and lower() never match
+        IF v_end <= v_start THEN
+            RAISE EXCEPTION 'bookings_valid_period: return % is not after pickup %', v_end, v_start
+                USING ERRCODE = 'check_violation';
+        END IF;
+        RETURN tsrange(v_start, v_end, '[)');
+    END;
+    $$ LANGUAGE plpgsql STABLE;
+
+    CREATE OR REPLACE FUNCTION bookings_set_rental_period() RETURNS TRIGGER AS $$
+    BEGIN
+        NEW.rental_period := booking_period(NEW.start_date, NEW.pickup_time,
+                                            NEW.end_date, NEW.return_time);
+        RETURN NEW;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    DROP TRIGGER IF EXISTS trg_bookings_rental_period ON bookings;
+    CREATE TRIGGER trg_bookings_rental_period
+        BEFORE INSERT OR UPDATE OF start_date, pickup_time, end_date, return_time ON bookings
+        FOR EACH ROW EXECUTE FUNCTION bookings_set_rental_period();
+"""
+
+
+BOOKING_CHANGES_SQL = """
+    CREATE TABLE IF NOT EXISTS booking_changes (
+        seq BIGSERIAL PRIMARY KEY,
+        booking_id INTEGER NOT NULL,
+        changed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    CREATE INDEX IF NOT EXISTS idx_booking_changes_changed ON booking_changes(changed_at);
+
+    CREATE OR REPLACE FUNCTION bookings_log_change() RETURNS TRIGGER AS $$
+    BEGIN
+        IF TG_OP = 'DELETE' THEN
+            INSERT INTO booking_changes (booking_id) VALUES (OLD.id);
+            RETURN OLD;
+        END IF;
+        INSERT INTO booking_changes (booking_id) VALUES (NEW.id);
+        RETURN NEW;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    DROP TRIGGER IF EXISTS trg_bookings_log_change ON bookings;
+    CREATE TRIGGER trg_bookings_log_change
+        AFTER INSERT OR UPDATE OR DELETE ON bookings
+        FOR EACH ROW EXECUTE FUNCTION bookings_log_change();
+"""
+
+BOOKING_ROLLUPS_SQL = """
+    CREATE TABLE IF NOT EXISTS booking_rollup_daily (
+        day DATE NOT NULL,
+        vehicle_id INTEGER NOT NULL,
+        category VARCHAR(50),
+        status VARCHAR(50) NOT NULL,
+        bookings INTEGER NOT NULL DEFAULT 0,
+        revenue DECIMAL(12,2) NOT NULL DEFAULT 0,
+        half_days INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (day, vehicle_id, status)
+    );
+
+    CREATE TABLE IF NOT EXISTS booking_rollup_monthly (
+        month DATE NOT NULL,
+        vehicle_id INTEGER NOT NULL,
+        category VARCHAR(50),
+        status VARCHAR(50) NOT NULL,
+        bookings INTEGER NOT NULL DEFAULT 0,
+        revenue DECIMAL(12,2) NOT NULL DEFAULT 0,
+        half_days INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (month, vehicle_id, status)
+    );
+
+    -- Add (p_sign = 1) or remove (p_sign = -1) one booking's contribution.
+    -- The booking and its revenue count on the pickup day; rented half-days are spread
+    -- over the days it covers (pickup and return day one half each, days between two).
+    CREATE OR REPLACE FUNCTION booking_rollup_apply(p_vehicle_id INTEGER, p_status TEXT,
+                                                    p_total NUMERIC, p_period TSRANGE,
+                                                    p_created TIMESTAMP, p_sign INTEGER)
+    RETURNS VOID AS $$
+    DECLARE
+        v_category VARCHAR(50);
+        v_first DATE := lower(p_period)::date;
+        v_last DATE := upper(p_period)::date;
+    BEGIN
+        SELECT category INTO v_category FROM vehicles WHERE id = p_vehicle_id;
+
+        WITH contributions AS (
+            SELECT COALESCE(v_first, p_created::date, CURRENT_DATE) AS day,
+                   1 AS bookings, COALESCE(p_total, 0) AS revenue, 0 AS half_days
+            UNION ALL
+            SELECT d::date, 0, 0,
+                   CASE WHEN v_first = v_last OR d::date IN (v_first, v_last) THEN 1 ELSE 2 END
+            FROM generate_series(v_first, v_last, interval '1 day') d
+            WHERE p_period IS NOT NULL
+        ), per_day AS (
+            SELECT day, SUM(bookings) * p_sign AS bookings, SUM(revenue) * p_sign AS revenue,
+                   SUM(half_days) * p_sign AS half_days
+            FROM contributions
+            GROUP BY day
+        ), daily AS (
+            INSERT INTO booking_rollup_daily AS r
+                (day, vehicle_id, category, status, bookings, revenue, half_days)
+            SELECT day, p_vehicle_id, v_category, p_status, bookings, revenue, half_days
+            FROM per_day
+            ON CONFLICT (day, vehicle_id, status) DO UPDATE SET
+                bookings = r.bookings + EXCLUDED.bookings,
+                revenue = r.revenue + EXCLUDED.revenue,
+                half_days = r.half_days + EXCLUDED.half_days
+        )
+        INSERT INTO booking_rollup_monthly AS r
+            (month, vehicle_id, category, status, bookings, revenue, half_days)
+        SELECT date_trunc('month', day)::date, p_vehicle_id, v_category, p_status,
+               SUM(bookings), SUM(revenue), SUM(half_days)
+        FROM per_day
+        GROUP BY 1
+        ON CONFLICT (month, vehicle_id, status) DO UPDATE SET
+            bookings = r.bookings + EXCLUDED.bookings,
+            revenue = r.revenue + EXCLUDED.revenue,
+            half_days = r.half_days + EXCLUDED.half_days;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    CREATE OR REPLACE FUNCTION bookings_update_rollups() RETURNS TRIGGER AS $$
+    BEGIN
+        IF TG_OP IN ('UPDATE', 'DELETE') THEN
+            PERFORM booking_rollup_apply(OLD.vehicle_id, OLD.status, OLD.total_price,
+                                         OLD.rental_period, OLD.created_at, -1);
+        END IF;
+        IF TG_OP IN ('INSERT', 'UPDATE') THEN
+            PERFORM booking_rollup_apply(NEW.vehicle_id, NEW.status, NEW.total_price,
+                                         NEW.rental_period, NEW.created_at, 1);
+        END IF;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    DROP TRIGGER IF EXISTS trg_bookings_update_rollups ON bookings;
+    CREATE TRIGGER trg_bookings_update_rollups
+        AFTER INSERT OR DELETE OR UPDATE OF vehicle_id, status, total_price, start_date,
+            pickup_time, end_date, return_time ON bookings
+        FOR EACH ROW EXECUTE FUNCTION bookings_update_rollups();
+
+    CREATE OR REPLACE FUNCTION vehicles_update_rollup_category() RETURNS TRIGGER AS $$
+    BEGIN
+        UPDATE booking_rollup_daily SET category = NEW.category WHERE vehicle_id = NEW.id;
+        UPDATE booking_rollup_monthly SET category = NEW.category WHERE vehicle_id = NEW.id;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    DROP TRIGGER IF EXISTS trg_vehicles_rollup_category ON vehicles;
+    CREATE TRIGGER trg_vehicles_rollup_category
+        AFTER UPDATE OF category ON vehicles
+        FOR EACH ROW WHEN (OLD.category IS DISTINCT FROM NEW.category)
+        EXECUTE FUNCTION vehicles_update_rollup_category();
+"""
+
+SLOT_BITMAPS_SQL = """
+    CREATE TABLE IF NOT EXISTS vehicle_slot_bitmaps (
+        vehicle_id INTEGER NOT NULL,
+        month DATE NOT NULL,
+        slots BIGINT NOT NULL DEFAULT 0,
+        PRIMARY KEY (vehicle_id, month)
+    );
+
+    -- Bits 2d and 2d+1 are the morning and afternoon of day d+1 of the month. The pickup
+    -- and return days mark the half their time falls in; days between are marked in full.
+    CREATE OR REPLACE FUNCTION booking_slot_bits(p_period TSRANGE, p_month DATE) RETURNS BIGINT AS $$
+        SELECT COALESCE(bit_or(
+            (CASE WHEN g.ts::date = lower(p_period)::date
+                      THEN CASE WHEN extract(hour FROM lower(p_period)) < 12 THEN 1 ELSE 2 END
+                  WHEN g.ts::date = upper(p_period)::date
+                      THEN CASE WHEN extract(hour FROM upper(p_period)) > 12 THEN 2 ELSE 1 END
+                  ELSE 3 END)::bigint << (2 * (g.ts::date - p_month))), 0)
+        FROM generate_series(GREATEST(lower(p_period)::date, p_month),
+                             LEAST(upper(p_period)::date, (p_month + interval '1 month')::date - 1),
+                             interval '1 day') AS g(ts)
+    $$ LANGUAGE sql IMMUTABLE;
+
+    CREATE OR REPLACE FUNCTION refresh_vehicle_slot_bitmaps(p_vehicle_id INTEGER, p_from DATE, p_to DATE)
+    RETURNS VOID AS $$
+    DECLARE
+        v_first DATE := date_trunc('month', p_from)::date;
+        v_last DATE := date_trunc('month', p_to)::date;
+    BEGIN
+        INSERT INTO vehicle_slot_bitmaps (vehicle_id, month)
+        SELECT p_vehicle_id, m::date FROM generate_series(v_first, v_last, interval '1 month') m
+        ON CONFLICT DO NOTHING;
+
+        -- Lock before recounting so the UPDATE's snapshot includes concurrent writers' bookings
+        PERFORM 1 FROM vehicle_slot_bitmaps
+        WHERE vehicle_id = p_vehicle_id AND month BETWEEN v_first AND v_last
+        ORDER BY month
+        FOR UPDATE;
+
+        UPDATE vehicle_slot_bitmaps s SET slots = COALESCE((
+            SELECT bit_or(booking_slot_bits(b.rental_period, s.month))
+            FROM bookings b
+            WHERE b.vehicle_id = p_vehicle_id AND b.status != 'cancelled'
+              AND b.rental_period && tsrange((s.month - 1)::timestamp,
+                                             (s.month + interval '1 month')::timestamp, '[)')
+        ), 0)
+        WHERE s.vehicle_id = p_vehicle_id AND s.month BETWEEN v_first AND v_last;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    CREATE OR REPLACE FUNCTION bookings_refresh_slot_bitmaps() RETURNS TRIGGER AS $$
+    BEGIN
+        IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.rental_period IS NOT NULL THEN
+            PERFORM refresh_vehicle_slot_bitmaps(OLD.vehicle_id, lower(OLD.rental_period)::date,
+                                                 upper(OLD.rental_period)::date);
+        END IF;
+        IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.rental_period IS NOT NULL THEN
+            PERFORM refresh_vehicle_slot_bitmaps(NEW.vehicle_id, lower(NEW.rental_period)::date,
+                                                 upper(NEW.rental_period)::date);
+        END IF;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    DROP TRIGGER IF EXISTS trg_bookings_refresh_slot_bitmaps ON bookings;
+    CREATE TRIGGER trg_bookings_refresh_slot_bitmaps
+        AFTER INSERT OR DELETE OR UPDATE OF vehicle_id, status, start_date, pickup_time,
+            end_date, return_time ON bookings
+        FOR EACH ROW EXECUTE FUNCTION bookings_refresh_slot_bitmaps();
+"""
+
+CATALOG_STATE_SQL = """
+    CREATE TABLE IF NOT EXISTS catalog_state (
+        id INTEGER PRIMARY KEY DEFAULT 1 CHECK (id = 1),
+        version BIGINT NOT NULL DEFAULT 1,
+        changed_at TIMESTAMP NOT NULL DEFAULT date_trunc('second', now() AT TIME ZONE 'UTC')
+    );
+    INSERT INTO catalog_state (id) VALUES (1) ON CONFLICT DO NOTHING;
+
+    -- Any vehicle write bumps the version; changed_at (UTC, whole seconds) is the catalog's Last-Modified
+    CREATE OR REPLACE FUNCTION vehicles_bump_catalog_version() RETURNS TRIGGER AS $$
+    BEGIN
+        UPDATE catalog_state
+        SET version = version + 1,
+            changed_at = date_trunc('second', now() AT TIME ZONE 'UTC')
+        WHERE id = 1;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    DROP TRIGGER IF EXISTS trg_vehicles_catalog_version ON vehicles;
+    CREATE TRIGGER trg_vehicles_catalog_version
+        AFTER INSERT OR UPDATE OR DELETE ON vehicles
+        FOR EACH STATEMENT EXECUTE FUNCTION vehicles_bump_catalog_version();
+"""
+
+
+IMAGE_JOBS_SQL = """
+    -- Uploads waiting for (or finished with) background encoding. While pending, the target
+    -- row's image column holds the job's placeholder URL; replaces_url is the file it supersedes.
+    CREATE TABLE IF NOT EXISTS image_jobs (
+        id SERIAL PRIMARY KEY,
+        kind VARCHAR(20) NOT NULL,
+        target_id INTEGER NOT NULL,
+        spool_path TEXT NOT NULL,
+        filename TEXT NOT NULL,
+        replaces_url TEXT,
+        status VARCHAR(20) NOT NULL DEFAULT 'pending',
+        image_url TEXT,
+        error TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        finished_at TIMESTAMP
+    );
+    CREATE INDEX IF NOT EXISTS idx_image_jobs_pending ON image_jobs (id) WHERE status = 'pending';
+"""
+
+UPLOAD_REFS_SQL = """
+    -- How many vehicles/bookings point at each stored upload; files are only deleted at zero
+    CREATE TABLE IF NOT EXISTS upload_objects (
+        url TEXT PRIMARY KEY,
+        refs INTEGER NOT NULL DEFAULT 0,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+
+    CREATE OR REPLACE FUNCTION upload_ref_adjust(p_url TEXT, p_delta INTEGER) RETURNS VOID AS $$
+    BEGIN
+        IF p_url IS NULL OR p_url = '' OR p_url LIKE '/uploads/jobs/%' THEN
+            RETURN;
+        END IF;
+        INSERT INTO upload_objects (url, refs) VALUES (p_url, GREATEST(p_delta, 0))
+        ON CONFLICT (url) DO UPDATE SET refs = GREATEST(upload_objects.refs + p_delta, 0);
+    END;
+    $$ LANGUAGE plpgsql;
+
+    -- TG_ARGV[0] names the column holding the upload URL
+    CREATE OR REPLACE FUNCTION upload_refs_track() RETURNS TRIGGER AS $$
+    DECLARE
+        v_old TEXT;
+        v_new TEXT;
+    BEGIN
+        IF TG_OP IN ('UPDATE', 'DELETE') THEN
+            v_old := to_jsonb(OLD) ->> TG_ARGV[0];
+        END IF;
+        IF TG_OP IN ('INSERT', 'UPDATE') THEN
+            v_new := to_jsonb(NEW) ->> TG_ARGV[0];
+        END IF;
+        IF v_old IS DISTINCT FROM v_new THEN
+            PERFORM upload_ref_adjust(v_old, -1);
+            PERFORM upload_ref_adjust(v_new, 1);
+        END IF;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    DROP TRIGGER IF EXISTS trg_vehicles_upload_refs ON vehicles;
+    CREATE TRIGGER trg_vehicles_upload_refs
+        AFTER INSERT OR DELETE OR UPDATE OF image_url ON vehicles
+        FOR EACH ROW EXECUTE FUNCTION upload_refs_track('image_url');
+
+    DROP TRIGGER IF EXISTS trg_bookings_upload_refs ON bookings;
+    CREATE TRIGGER trg_bookings_upload_refs
+        AFTER INSERT OR DELETE OR UPDATE OF customer_photo ON bookings
+        FOR EACH ROW EXECUTE FUNCTION upload_refs_track('customer_photo');
+"""
+
+UPLOAD_GC_STATE_SQL = """
+    -- Last report written by flask gc-uploads, served by /admin/system/storage
+    CREATE TABLE IF NOT EXISTS upload_gc_state (
+        id INTEGER PRIMARY KEY DEFAULT 1 CHECK (id = 1),
+        report JSONB NOT NULL,
+        finished_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+    );
+"""
+
+
+def _try_schema_change(cursor, label, statements):
+    """Run optional DDL inside a savepoint so a failure doesn't abort init_db"""
+    cursor.execute("SAVEPOINT schema_change")
+    try:
+        for statement in statements:
+            cursor.execute(statement)
+        cursor.execute("RELEASE SAVEPOINT schema_change")
+        print(f"  ✅ {label}")
+        return True
+    except psycopg2.Error as e:
+        cursor.execute("ROLLBACK TO SAVEPOINT schema_change")
+        print(f"  ⚠️  Skipped {label}: {str(e).strip()}")
+        return False
+
+
 def init_db():
     """Check and update database schema"""
     with get_db_connection() as conn:
@@ -202,6 +1547,11 @@ def init_db():
             cursor.execute("ALTER TABLE vehicles ADD COLUMN terms_and_conditions TEXT")
             print("  ✅ Added column: terms_and_conditions")
         
+        # {format: srcset} for the responsive derivatives of image_url
+        if 'image_variants' not in vehicle_columns:
+            cursor.execute("ALTER TABLE vehicles ADD COLUMN image_variants JSONB")
+            print("  ✅ Added column: image_variants")
+        
         # Check bookings table columns
         cursor.execute("""
             SELECT column_name 
@@ -248,6 +1598,114 @@ def init_db():
             cursor.execute("ALTER TABLE bookings ADD COLUMN total_price DECIMAL(10,2)")
             print("  ✅ Added column: total_price")
         
+        # Typed rental period, kept in sync with the VARCHAR date/time columns by trigger
+        if 'rental_period' not in booking_columns:
+            cursor.execute("ALTER TABLE bookings ADD COLUMN rental_period TSRANGE")
+            print("  ✅ Added column: rental_period")
+        
+        cursor.execute(BOOKING_PERIOD_FUNCTIONS_SQL)
+        # Row by row, so one malformed legacy booking doesn't stop the others being backfilled.
+        # Empty periods (pickup == return, accepted before) are recomputed too and end up NULL,
+        # where the month filter's start_date fallback still finds them
+        cursor.execute("SELECT COUNT(*) AS count FROM bookings WHERE rental_period IS NULL OR isempty(rental_period)")
+        missing = cursor.fetchone()['count']
+        if missing:
+            cursor.execute("""
+                DO $$
+                DECLARE
+                    r RECORD;
+                BEGIN
+                    FOR r IN SELECT id FROM bookings WHERE rental_period IS NULL OR isempty(rental_period) LOOP
+                        BEGIN
+                            UPDATE bookings
+                            SET rental_period = booking_period(start_date, pickup_time, end_date, return_time)
+                            WHERE id = r.id;
+                        EXCEPTION WHEN data_exception OR check_violation THEN
+                            UPDATE bookings SET rental_period = NULL WHERE id = r.id;
+                        END;
+                    END LOOP;
+                END $$;
+            """)
+            cursor.execute("SELECT COUNT(*) AS count FROM bookings WHERE rental_period IS NULL")
+            unparsed = cursor.fetchone()['count']
+            if missing > unparsed:
+                print(f"  ✅ Backfilled rental_period for {missing - unparsed} bookings")
+            if unparsed:
+                print(f"  ⚠️  {unparsed} bookings have malformed, inverted or zero-length periods; "
+                      f"re-save them to include them in availability checks")
+        
+        # Per-day booking number counter
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS booking_counters (
+                day DATE PRIMARY KEY,
+                last_value INTEGER NOT NULL
+            )
+        """)
+        
+        # Month filters use half-open ranges on the typed period instead of SUBSTRING(start_date)
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_bookings_period_start ON bookings (lower(rental_period))")
+        cursor.execute("DROP INDEX IF EXISTS idx_bookings_month")
+        cursor.execute("""CREATE INDEX IF NOT EXISTS idx_bookings_unparsed_start
+            ON bookings (start_date text_pattern_ops) WHERE rental_period IS NULL""")
+        
+        # Trigram indexes for substring / typo-tolerant search
+        _try_schema_change(cursor, "Trigram search indexes", [
+            "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+            "CREATE INDEX IF NOT EXISTS idx_bookings_number_trgm ON bookings USING gin (booking_number gin_trgm_ops)",
+            "CREATE INDEX IF NOT EXISTS idx_bookings_customer_trgm ON bookings USING gin (customer_name gin_trgm_ops)",
+            "CREATE INDEX IF NOT EXISTS idx_bookings_ic_trgm ON bookings USING gin (ic_number gin_trgm_ops)",
+            "CREATE INDEX IF NOT EXISTS idx_vehicles_name_trgm ON vehicles USING gin (name gin_trgm_ops)",
+            "CREATE INDEX IF NOT EXISTS idx_vehicles_plate_trgm ON vehicles USING gin (license_plate gin_trgm_ops)",
+            "CREATE INDEX IF NOT EXISTS idx_vehicles_type_trgm ON vehicles USING gin (type gin_trgm_ops)",
+            "CREATE INDEX IF NOT EXISTS idx_vehicles_cc_trgm ON vehicles USING gin ((cc::TEXT) gin_trgm_ops)",
+        ])
+        
+        # Keyset pagination indexes for /admin/bookings sorts (id breaks ties)
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_bookings_created_id ON bookings(created_at, id)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_bookings_start_id ON bookings(start_date, id)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_bookings_customer_id ON bookings(customer_name, id)")
+        
+        # Change log read by each worker's in-memory booking index
+        cursor.execute(BOOKING_CHANGES_SQL)
+        
+        cursor.execute("SELECT to_regclass('booking_rollup_daily') IS NOT NULL AS present")
+        rollups_present = cursor.fetchone()['present']
+        cursor.execute(BOOKING_ROLLUPS_SQL)
+        if not rollups_present:
+            print(f"  ✅ Created rollup tables ({backfill_booking_rollups(cursor)} bookings backfilled)")
+        
+        cursor.execute("SELECT to_regclass('vehicle_slot_bitmaps') IS NOT NULL AS present")
+        bitmaps_present = cursor.fetchone()['present']
+        cursor.execute(SLOT_BITMAPS_SQL)
+        if not bitmaps_present:
+            print(f"  ✅ Created slot bitmaps ({backfill_slot_bitmaps(cursor)} vehicles backfilled)")
+        
+        cursor.execute(CATALOG_STATE_SQL)
+        cursor.execute(IMAGE_JOBS_SQL)
+        
+        cursor.execute("SELECT to_regclass('upload_objects') IS NOT NULL AS present")
+        upload_refs_present = cursor.fetchone()['present']
+        cursor.execute(UPLOAD_REFS_SQL)
+        if not upload_refs_present:
+            print(f"  ✅ Created upload reference counts ({backfill_upload_refs(cursor)} stored files)")
+        cursor.execute(UPLOAD_GC_STATE_SQL)
+        
+        cursor.execute("SELECT 1 FROM pg_constraint WHERE conname = 'bookings_no_overlap'")
+        if not cursor.fetchone():
+            added = _try_schema_change(cursor, "Added constraint: bookings_no_overlap", [
+                "CREATE EXTENSION IF NOT EXISTS btree_gist",
+                """ALTER TABLE bookings ADD CONSTRAINT bookings_no_overlap
+                   EXCLUDE USING gist (vehicle_id WITH =, rental_period WITH &&)
+                   WHERE (status != 'cancelled')""",
+            ])
+            if not added:
+                # Overlapping bookings already exist - still index the range for lookups
+                _try_schema_change(cursor, "Added index: idx_bookings_vehicle_period", [
+                    "CREATE EXTENSION IF NOT EXISTS btree_gist",
+                    """CREATE INDEX IF NOT EXISTS idx_bookings_vehicle_period
+                       ON bookings USING gist (vehicle_id, rental_period)""",
+                ])
+        
         # Check if default admin exists
         cursor.execute("SELECT COUNT(*) as count FROM admin_users")
         admin_count = cursor.fetchone()['count']
@@ -264,6 +1722,242 @@ def init_db():
         print("Database schema check completed!\n")
 
 
+# --- BOOKING INTERVAL INDEX ---
+class VehicleIntervals:
+    """Booking intervals of one vehicle, sorted by start, with a running max of end times"""
+    __slots__ = ('intervals', 'max_end')
+
+    def __init__(self, intervals=()):
+        self.intervals = sorted(intervals)  # (start, end, booking_id)
+        self.max_end = []
+        self._rebuild()
+
+    def _rebuild(self):
+        self.max_end = []
+        running = None
+        for _, end, _ in self.intervals:
+            if running is None or end > running:
+                running = end
+            self.max_end.append(running)
+
+    def add(self, start, end, booking_id):
+        insort(self.intervals, (start, end, booking_id))
+        self._rebuild()
+
+    def remove(self, booking_id):
+        self.intervals = [iv for iv in self.intervals if iv[2] != booking_id]
+        self._rebuild()
+
+    def has_overlap(self, start, end):
+        idx = bisect_left(self.intervals, (end,))  # intervals starting before `end`
+        return idx > 0 and self.max_end[idx - 1] > start
+
+    def overlapping(self, start, end):
+        idx = bisect_left(self.intervals, (end,))
+        found = []
+        j = idx - 1
+        while j >= 0 and self.max_end[j] > start:
+            if self.intervals[j][1] > start:
+                found.append(self.intervals[j])
+            j -= 1
+        found.reverse()
+        return found
+
+
+class BookingIntervalIndex:
+    """Per-worker index of non-cancelled booking periods by vehicle.
+
+    Loaded in a background thread on first use and kept current by replaying the
+    booking_changes log (written by a trigger on bookings) at most every
+    BOOKING_INDEX_SYNC_INTERVAL seconds. Writers call mark_stale() so the next read
+    in this worker syncs immediately. Query methods return None while the index is
+    cold so callers can fall back to SQL.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self._pid = os.getpid()
+        self._vehicles = {}
+        self._booking_vehicle = {}
+        self._loaded = False
+        self._loading = False
+        self._retry_after = 0.0
+        self._last_seq = 0
+        self._last_sync = 0.0
+        self._last_prune = 0.0
+
+    def _check_fork(self):
+        if self._pid != os.getpid():
+            # A loader thread does not survive fork; reload in this worker
+            self.__init__()
+
+    def warm(self):
+        """Start loading in the background if the index is cold"""
+        if not BOOKING_INDEX_ENABLED:
+            return
+        self._check_fork()
+        with self._lock:
+            if self._loaded or self._loading or time.monotonic() < self._retry_after:
+                return
+            self._loading = True
+        threading.Thread(target=self._load, name='booking-index-loader', daemon=True).start()
+
+    def _load(self):
+        try:
+            with get_db_connection(request_scoped=False) as conn:
+                cursor = get_db_cursor(conn)
+                cursor.execute('SELECT COALESCE(MAX(seq), 0) AS seq FROM booking_changes')
+                last_seq = cursor.fetchone()['seq']
+                cursor.execute('''
+                    SELECT id, vehicle_id, lower(rental_period) AS start_at, upper(rental_period) AS end_at
+                    FROM bookings
+                    WHERE status != 'cancelled' AND NOT isempty(rental_period)
+                ''')
+                rows = cursor.fetchall()
+            
+            grouped = {}
+            booking_vehicle = {}
+            for row in rows:
+                grouped.setdefault(row['vehicle_id'], []).append((row['start_at'], row['end_at'], row['id']))
+                booking_vehicle[row['id']] = row['vehicle_id']
+            
+            with self._lock:
+                self._vehicles = {vid: VehicleIntervals(ivs) for vid, ivs in grouped.items()}
+                self._booking_vehicle = booking_vehicle
+                self._last_seq = last_seq
+                self._last_sync = time.monotonic()
+                self._loaded = True
+            print(f"📅 Booking index loaded: {len(rows)} bookings, {len(grouped)} vehicles")
+        except Exception as e:
+            self._retry_after = time.monotonic() + 30
+            print(f"⚠️  Booking index load failed, falling back to SQL: {e}")
+        finally:
+            self._loading = False
+
+    def _apply(self, booking_id, vehicle_id, start_at, end_at, status):
+        old_vehicle = self._booking_vehicle.pop(booking_id, None)
+        if old_vehicle is not None and old_vehicle in self._vehicles:
+            self._vehicles[old_vehicle].remove(booking_id)
+        
+        if vehicle_id is None or status == 'cancelled' or start_at is None or end_at is None:
+            return
+        if start_at >= end_at:
+            return
+        self._vehicles.setdefault(vehicle_id, VehicleIntervals()).add(start_at, end_at, booking_id)
+        self._booking_vehicle[booking_id] = vehicle_id
+
+    def _sync(self):
+        """Replay booking_changes since the last sync; returns False if the index is unusable"""
+        if time.monotonic() - self._last_sync < BOOKING_INDEX_SYNC_INTERVAL:
+            return True
+        if not self._sync_lock.acquire(blocking=False):
+            return True  # another thread is syncing; serve the current snapshot
+        try:
+            started = time.monotonic()
+            with get_db_connection(request_scoped=False) as conn:
+                cursor = get_db_cursor(conn)
+                cursor.execute('''
+                    SELECT DISTINCT ON (c.booking_id)
+                        c.booking_id, c.seq, b.vehicle_id, b.status,
+                        lower(b.rental_period) AS start_at, upper(b.rental_period) AS end_at
+                    FROM booking_changes c
+                    LEFT JOIN bookings b ON b.id = c.booking_id
+                    WHERE c.seq > %s
+                    OR c.changed_at > LOCALTIMESTAMP - make_interval(secs => %s)
+                    ORDER BY c.booking_id, c.seq DESC
+                ''', (self._last_seq, BOOKING_CHANGES_REPLAY_SECONDS))
+                changes = cursor.fetchall()
+                
+                if started - self._last_prune > 3600:
+                    cursor.execute(
+                        "DELETE FROM booking_changes WHERE changed_at < LOCALTIMESTAMP - make_interval(hours => %s)",
+                        (BOOKING_CHANGES_RETENTION_HOURS,))
+                    self._last_prune = started
+            
+            with self._lock:
+                for change in changes:
+                    self._apply(change['booking_id'], change['vehicle_id'],
+                                change['start_at'], change['end_at'], change['status'])
+                    self._last_seq = max(self._last_seq, change['seq'])
+                self._last_sync = started
+            return True
+        except Exception as e:
+            print(f"⚠️  Booking index sync failed, marking cold: {e}")
+            with self._lock:
+                self._loaded = False
+                self._retry_after = time.monotonic() + 30
+            return False
+        finally:
+            self._sync_lock.release()
+
+    def _ready(self):
+        if not BOOKING_INDEX_ENABLED:
+            return False
+        self._check_fork()
+        if not self._loaded:
+            self.warm()
+            return False
+        if time.monotonic() - self._last_sync > BOOKING_CHANGES_RETENTION_HOURS * 3600 / 2:
+            # Change log may have been pruned past our position - reload from scratch
+            self._loaded = False
+            self.warm()
+            return False
+        return self._sync()
+
+    def mark_stale(self):
+        """Force the next read in this worker to sync with the change log"""
+        self._last_sync = 0.0
+
+    def conflicting_vehicles(self, vehicle_ids, start, end):
+        """Set of vehicle ids with a booking overlapping [start, end), or None if cold"""
+        if not self._ready():
+            return None
+        with self._lock:
+            return {vid for vid in vehicle_ids
+                    if vid in self._vehicles and self._vehicles[vid].has_overlap(start, end)}
+
+    def overlapping(self, vehicle_id, start, end):
+        """[(start, end, booking_id)] overlapping [start, end) for one vehicle, or None if cold"""
+        if not self._ready():
+            return None
+        with self._lock:
+            intervals = self._vehicles.get(vehicle_id)
+            return intervals.overlapping(start, end) if intervals else []
+
+    def stats(self):
+        return {
+            'pid': os.getpid(),
+            'enabled': BOOKING_INDEX_ENABLED,
+            'loaded': self._loaded,
+            'vehicles': len(self._vehicles),
+            'bookings': len(self._booking_vehicle),
+            'last_seq': self._last_seq,
+            'seconds_since_sync': round(time.monotonic() - self._last_sync, 3) if self._last_sync else None,
+        }
+
+
+booking_index = BookingIntervalIndex()
+
+
+@app.before_request
+def warm_booking_index():
+    booking_index.warm()
+
+
+IMMUTABLE_UPLOAD_PATH = re.compile(r'^/static/uploads/(vehicles|customers)/[0-9a-f]{2}/[0-9a-f]{2}/')
+
+
+@app.after_request
+def cache_immutable_uploads(response):
+    """Content-addressed uploads (and their variants) never change, so let clients keep them"""
+    match = IMMUTABLE_UPLOAD_PATH.match(request.path)
+    if match and response.status_code in (200, 304):
+        scope = 'private' if match.group(1) == 'customers' else 'public'
+        response.headers['Cache-Control'] = f"{scope}, max-age={UPLOAD_IMMUTABLE_MAX_AGE}, immutable"
+    return response
+
+
 # --- AUTHENTICATION ---
 def login_required(f):
     @wraps(f)
@@ -275,115 +1969,403 @@ def login_required(f):
     return decorated_function
 
 
-# --- UTILITY FUNCTIONS ---
-def generate_booking_number():
-    """Generate unique booking number with format: VR-YYYYMMDD-XXXX"""
-    now = datetime.now()
-    date_str = now.strftime('%Y%m%d')
-    prefix = f'VR-{date_str}-'
+# --- UTILITY FUNCTIONS ---
+BOOKING_NUMBER_PREFIX = 'VR'
+_booking_number_blocks = {}  # date_str -> [next, last] reserved by this worker
+_booking_number_lock = threading.Lock()
+
+
+def _reserve_booking_numbers(cursor, date_str, count):
+    """Advance today's counter by `count` and return the last number reserved (one statement)"""
+    day = datetime.strptime(date_str, '%Y%m%d').date()
+    cursor.execute(
+        'UPDATE booking_counters SET last_value = last_value + %s WHERE day = %s RETURNING last_value',
+        (count, day))
+    row = cursor.fetchone()
+    if row:
+        return row['last_value']
+    
+    # First booking of the day: seed from numbers already issued (e.g. before this counter existed)
+    prefix = f'{BOOKING_NUMBER_PREFIX}-{date_str}-'
+    cursor.execute('''
+        INSERT INTO booking_counters (day, last_value)
+        VALUES (%s, COALESCE((
+            SELECT MAX(SUBSTRING(booking_number FROM %s)::int) FROM bookings
+            WHERE booking_number LIKE %s AND SUBSTRING(booking_number FROM %s) ~ '^[0-9]+$'
+        ), 0) + %s)
+        ON CONFLICT (day) DO UPDATE SET last_value = booking_counters.last_value + %s
+        RETURNING last_value
+    ''', (day, len(prefix) + 1, prefix + '%', len(prefix) + 1, count, count))
+    return cursor.fetchone()['last_value']
+
+
+def generate_booking_number():
+    """Generate unique booking number with format: VR-YYYYMMDD-XXXX
+
+    With BOOKING_NUMBER_BLOCK_SIZE = 1 the per-day counter row is advanced inside the
+    caller's transaction. Larger blocks are reserved in a separate short transaction
+    and handed out by this worker, so a restart can leave gaps in the sequence.
+    """
+    date_str = datetime.now().strftime('%Y%m%d')
+    
+    if BOOKING_NUMBER_BLOCK_SIZE <= 1:
+        with get_db_connection() as conn:
+            sequence = _reserve_booking_numbers(get_db_cursor(conn), date_str, 1)
+    else:
+        with _booking_number_lock:
+            block = _booking_number_blocks.get(date_str)
+            if not block or block[0] > block[1]:
+                with get_db_connection(request_scoped=False) as conn:
+                    last = _reserve_booking_numbers(get_db_cursor(conn), date_str, BOOKING_NUMBER_BLOCK_SIZE)
+                _booking_number_blocks.clear()
+                block = _booking_number_blocks[date_str] = [last - BOOKING_NUMBER_BLOCK_SIZE + 1, last]
+            sequence = block[0]
+            block[0] += 1
+    
+    return f'{BOOKING_NUMBER_PREFIX}-{date_str}-{str(sequence).zfill(4)}'
+
+
+def check_availability_bulk(vehicle_ids, start_datetime, end_datetime):
+    """Check availability of many vehicles for one date range in a single query.
+
+    Returns {vehicle_id: available} for every id passed in.
+    """
+    vehicle_ids = list(vehicle_ids)
+    if not vehicle_ids:
+        return {}
+    
+    if isinstance(start_datetime, str):
+        start_datetime = datetime.strptime(start_datetime, '%Y-%m-%d %H:%M')
+    if isinstance(end_datetime, str):
+        end_datetime = datetime.strptime(end_datetime, '%Y-%m-%d %H:%M')
+    
+    booked = booking_index.conflicting_vehicles(vehicle_ids, start_datetime, end_datetime)
+    if booked is not None:
+        return {vehicle_id: vehicle_id not in booked for vehicle_id in vehicle_ids}
     
     with get_db_connection() as conn:
         cursor = get_db_cursor(conn)
-        today_start = now.strftime('%Y-%m-%d 00:00:00')
-        
-        cursor.execute(
-            'SELECT COUNT(*) as count FROM bookings WHERE created_at >= %s',
-            (today_start,)
-        )
-        today_count = cursor.fetchone()['count']
-        
-        sequence = str(today_count + 1).zfill(4)
-        booking_number = prefix + sequence
-        
-        cursor.execute('SELECT id FROM bookings WHERE booking_number = %s', (booking_number,))
-        while cursor.fetchone():
-            today_count += 1
-            sequence = str(today_count + 1).zfill(4)
-            booking_number = prefix + sequence
-            cursor.execute('SELECT id FROM bookings WHERE booking_number = %s', (booking_number,))
+        query = '''
+            SELECT DISTINCT vehicle_id FROM bookings 
+            WHERE vehicle_id = ANY(%s) 
+            AND status != 'cancelled'
+            AND rental_period && tsrange(%s::timestamp, %s::timestamp, '[)')
+        '''
+        cursor.execute(query, (vehicle_ids, start_datetime, end_datetime))
+        booked = {row['vehicle_id'] for row in cursor.fetchall()}
     
-    return booking_number
+    return {vehicle_id: vehicle_id not in booked for vehicle_id in vehicle_ids}
 
 
 def check_availability(vehicle_id, start_datetime, end_datetime):
     """Check if vehicle is available for given date range"""
+    return check_availability_bulk([vehicle_id], start_datetime, end_datetime)[vehicle_id]
+
+
+# Half-day slot bits used by the calendar views; vehicle_slot_bitmaps packs them 2 bits per day
+MORNING = 1
+AFTERNOON = 2
+DAY_STATUS = {0: 'available', MORNING: 'half', AFTERNOON: 'half', MORNING | AFTERNOON: 'full'}
+
+
+def month_bounds(year, month):
+    """Return (first day of month, first day of next month) as datetimes"""
+    month_start = datetime(year, month, 1)
+    if month == 12:
+        next_month = datetime(year + 1, 1, 1)
+    else:
+        next_month = datetime(year, month + 1, 1)
+    return month_start, next_month
+
+
+def add_months(day, months):
+    """First day of the month `months` after the month containing `day`"""
+    index = day.year * 12 + day.month - 1 + months
+    return day.replace(year=index // 12, month=index % 12 + 1, day=1)
+
+
+def days_in_month(month_start):
+    return (add_months(month_start, 1) - month_start).days
+
+
+def get_slot_bitmaps(vehicle_ids, first_month, end_month):
+    """{vehicle_id: {month: slots}} for months in [first_month, end_month); missing months are free"""
+    bitmaps = {vehicle_id: {} for vehicle_id in vehicle_ids}
+    if not vehicle_ids:
+        return bitmaps
     with get_db_connection() as conn:
         cursor = get_db_cursor(conn)
-        query = '''
-            SELECT * FROM bookings 
-            WHERE vehicle_id = %s 
-            AND status != 'cancelled'
-            AND (start_date || ' ' || pickup_time)::timestamp < %s::timestamp
-            AND (end_date || ' ' || return_time)::timestamp > %s::timestamp
-        '''
-        cursor.execute(query, (vehicle_id, end_datetime, start_datetime))
-        conflict = cursor.fetchone()
-        return conflict is None
+        cursor.execute('''
+            SELECT vehicle_id, month, slots FROM vehicle_slot_bitmaps
+            WHERE vehicle_id = ANY(%s) AND month >= %s AND month < %s
+        ''', (list(vehicle_ids), first_month, end_month))
+        for row in cursor.fetchall():
+            bitmaps[row['vehicle_id']][row['month']] = row['slots']
+    return bitmaps
+
+
+def backfill_slot_bitmaps(cursor):
+    """Rebuild vehicle_slot_bitmaps from every booking; returns the number of vehicles covered"""
+    cursor.execute("LOCK TABLE bookings IN SHARE MODE")
+    cursor.execute("TRUNCATE vehicle_slot_bitmaps")
+    cursor.execute('''
+        SELECT refresh_vehicle_slot_bitmaps(vehicle_id, MIN(lower(rental_period))::date,
+                                            MAX(upper(rental_period))::date)
+        FROM bookings
+        WHERE status != 'cancelled' AND rental_period IS NOT NULL
+        GROUP BY vehicle_id
+    ''')
+    return cursor.rowcount
+
+
+@app.cli.command('rebuild-slot-bitmaps')
+def rebuild_slot_bitmaps_command():
+    """Rebuild the per-month half-day slot bitmaps from bookings"""
+    with get_db_connection() as conn:
+        count = backfill_slot_bitmaps(get_db_cursor(conn))
+    print(f"✅ Slot bitmaps rebuilt for {count} vehicles")
+
+
+def window_slots(month_bitmaps, first_date, num_days):
+    """Splice monthly bitmaps into one integer holding 2 bits per day from first_date"""
+    month = first_date.replace(day=1)
+    combined = 0
+    offset = 0
+    while offset < first_date.day - 1 + num_days:
+        combined |= month_bitmaps.get(month, 0) << (2 * offset)
+        offset += days_in_month(month)
+        month = add_months(month, 1)
+    return (combined >> (2 * (first_date.day - 1))) & ((1 << (2 * num_days)) - 1)
+
+
+def slot_masks_by_month(first_slot_date, first_half, last_slot_date, last_half):
+    """Per-month bitmasks selecting every half-day from (first date, half) to (last date, half)"""
+    masks = {}
+    month = first_slot_date.replace(day=1)
+    while month <= last_slot_date:
+        length = days_in_month(month)
+        lo = max((first_slot_date - month).days * 2 + first_half, 0)
+        hi = min((last_slot_date - month).days * 2 + last_half, length * 2 - 1)
+        if lo <= hi:
+            masks[month] = ((1 << (hi + 1)) - 1) ^ ((1 << lo) - 1)
+        month = add_months(month, 1)
+    return masks
+
+
+def get_calendar_range(vehicle_id, year, month, months=1):
+    """Calendar data for `months` consecutive months starting at year/month, from the slot bitmaps"""
+    range_start, _ = month_bounds(year, month)
+    end_year, end_month = year + (month - 1 + months) // 12, (month - 1 + months) % 12 + 1
+    range_end = datetime(end_year, end_month, 1)
+    
+    bitmaps = get_slot_bitmaps([vehicle_id], range_start.date(), range_end.date())[vehicle_id]
+    
+    calendars = []
+    for i in range(months):
+        cal_year, cal_month = year + (month - 1 + i) // 12, (month - 1 + i) % 12 + 1
+        month_start, next_month = month_bounds(cal_year, cal_month)
+        last_day = (next_month - month_start).days
+        slots = bitmaps.get(month_start.date(), 0)
+        
+        calendars.append({
+            'year': cal_year,
+            'month': cal_month,
+            'days': {day: DAY_STATUS[(slots >> (2 * (day - 1))) & 3] for day in range(1, last_day + 1)},
+            'month_name': month_start.strftime('%B'),
+            'first_day': month_start.weekday(),
+            'last_day': last_day
+        })
+    
+    return calendars
 
 
 def get_calendar_data(vehicle_id, year, month):
     """Generate calendar data with booking status"""
+    return get_calendar_range(vehicle_id, year, month, 1)[0]
+
+
+# --- SEARCH ---
+# Substring/prefix matches use ILIKE, which pg_trgm GIN indexes serve directly; typo
+# tolerance uses word similarity (<%) on name columns when pg_trgm is installed
+FUZZY_SEARCH_MIN_LENGTH = 3
+_trigram_available = None
+_trigram_checked_at = 0.0
+
+
+def trigram_search_available():
+    """Whether pg_trgm is installed (cached; a negative answer is re-checked every 5 minutes)"""
+    global _trigram_available, _trigram_checked_at
+    if _trigram_available or (_trigram_available is False and time.monotonic() - _trigram_checked_at < 300):
+        return _trigram_available
     with get_db_connection() as conn:
         cursor = get_db_cursor(conn)
-        
-        cursor.execute('''
-            SELECT start_date, pickup_time, end_date, return_time, status 
-            FROM bookings 
-            WHERE vehicle_id = %s AND status != 'cancelled'
-        ''', (vehicle_id,))
-        
-        bookings = cursor.fetchall()
+        cursor.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+        _trigram_available = cursor.fetchone() is not None
+    _trigram_checked_at = time.monotonic()
+    return _trigram_available
+
+
+def escape_like(value):
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def search_condition(search_query, columns, fuzzy_columns=()):
+    """SQL condition and params matching search_query in any of columns.
+
+    Each column gets a substring ILIKE; fuzzy_columns additionally match on trigram word
+    similarity so small typos in names still hit.
+    """
+    pattern = f'%{escape_like(search_query)}%'
+    clauses = [f'{column} ILIKE %s' for column in columns]
+    params = [pattern] * len(columns)
     
-    if month == 12:
-        next_month = datetime(year + 1, 1, 1)
-    else:
-        next_month = datetime(year, month + 1, 1)
+    if fuzzy_columns and len(search_query) >= FUZZY_SEARCH_MIN_LENGTH and trigram_search_available():
+        clauses.extend(f'%s <%% {column}' for column in fuzzy_columns)
+        params.extend([search_query] * len(fuzzy_columns))
     
-    last_day = (next_month - timedelta(days=1)).day
-    day_status = {}
+    return '(' + ' OR '.join(clauses) + ')', params
+
+
+# --- PUBLIC CATALOG CACHE ---
+# Rendered catalog pages are cached per worker, keyed by the catalog version in
+# catalog_state, so a vehicle write on any worker is picked up within the check interval.
+# Pages for an availability window also depend on bookings and expire after a short TTL.
+CATALOG_VERSION_CHECK_INTERVAL = 5  # seconds between catalog_state reads per worker
+CATALOG_WINDOW_CACHE_TTL = 30
+CATALOG_CACHE_MAX = 256
+_catalog_cache = {}  # (version, kind, *request params) -> entry
+_catalog_state = {'version': None, 'changed_at': None, 'checked_at': 0.0}
+_catalog_cache_lock = threading.Lock()
+
+
+def get_catalog_state():
+    """(version, changed_at) of the vehicle catalog, re-read at most every few seconds"""
+    now = time.monotonic()
+    with _catalog_cache_lock:
+        if _catalog_state['version'] is not None and now - _catalog_state['checked_at'] < CATALOG_VERSION_CHECK_INTERVAL:
+            return _catalog_state['version'], _catalog_state['changed_at']
     
-    for day in range(1, last_day + 1):
-        current_date = datetime(year, month, day)
-        morning_booked = False
-        afternoon_booked = False
-        
-        for booking in bookings:
-            try:
-                start = datetime.strptime(f"{booking['start_date']} {booking['pickup_time']}", '%Y-%m-%d %H:%M')
-                end = datetime.strptime(f"{booking['end_date']} {booking['return_time']}", '%Y-%m-%d %H:%M')
-                
-                if start.date() <= current_date.date() <= end.date():
-                    if start.date() == current_date.date():
-                        if start.hour < 12:
-                            morning_booked = True
-                        else:
-                            afternoon_booked = True
-                    elif end.date() == current_date.date():
-                        if end.hour > 12:
-                            afternoon_booked = True
-                        else:
-                            morning_booked = True
-                    else:
-                        morning_booked = True
-                        afternoon_booked = True
-            except:
-                continue
-        
-        if morning_booked and afternoon_booked:
-            day_status[day] = 'full'
-        elif morning_booked or afternoon_booked:
-            day_status[day] = 'half'
-        else:
-            day_status[day] = 'available'
+    with get_db_connection() as conn:
+        cursor = get_db_cursor(conn)
+        cursor.execute('SELECT version, changed_at FROM catalog_state WHERE id = 1')
+        row = cursor.fetchone()
+    changed_at = row['changed_at'].replace(tzinfo=timezone.utc)
     
-    return {
-        'year': year,
-        'month': month,
-        'days': day_status,
-        'month_name': datetime(year, month, 1).strftime('%B'),
-        'first_day': datetime(year, month, 1).weekday(),
-        'last_day': last_day
-    }
+    with _catalog_cache_lock:
+        if row['version'] != _catalog_state['version']:
+            _catalog_cache.clear()
+        _catalog_state.update(version=row['version'], changed_at=changed_at, checked_at=now)
+    return row['version'], changed_at
+
+
+def on_vehicles_changed():
+    """Drop this worker's cached catalog pages after a vehicle write"""
+    with _catalog_cache_lock:
+        _catalog_cache.clear()
+        _catalog_state['checked_at'] = 0.0
+
+
+def cached_catalog_response(key, render, last_modified, ttl=None, mimetype='text/html'):
+    """Serve a cached body (rendering it on a miss) with a strong ETag, answering 304 when it matches"""
+    now = time.monotonic()
+    with _catalog_cache_lock:
+        entry = _catalog_cache.get(key)
+    if entry is None or (entry['expires_at'] is not None and entry['expires_at'] <= now):
+        body = render()
+        entry = {
+            'body': body,
+            'etag': hashlib.sha256(body.encode('utf-8')).hexdigest()[:32],
+            'last_modified': last_modified,
+            'expires_at': now + ttl if ttl else None,
+        }
+        with _catalog_cache_lock:
+            if len(_catalog_cache) >= CATALOG_CACHE_MAX:
+                _catalog_cache.clear()
+            _catalog_cache[key] = entry
+    
+    response = Response(entry['body'], mimetype=mimetype)
+    response.set_etag(entry['etag'])
+    response.last_modified = entry['last_modified']
+    response.cache_control.public = True
+    response.cache_control.no_cache = True  # caches may store it but must revalidate
+    return response.make_conditional(request)
+
+
+# Public vehicle columns; the large terms_and_conditions text is only served per vehicle
+VEHICLE_LIST_COLUMNS = {
+    'id': 'id',
+    'name': 'name',
+    'type': 'type',
+    'cc': 'cc',
+    'category': 'category',
+    'price_day': 'price_day',
+    'price_3day': 'price_3day',
+    'price_weekly': 'price_weekly',
+    'price_monthly': 'price_monthly',
+    'image_url': 'image_url',
+    'image_variants': 'image_variants',
+    'has_terms': "COALESCE(btrim(terms_and_conditions), '') <> ''",
+}
+VEHICLE_DETAIL_COLUMNS = dict(VEHICLE_LIST_COLUMNS, terms_and_conditions='terms_and_conditions')
+VEHICLE_API_SORTS = ['name', 'type', 'cc', 'category', 'price_day', 'price_3day', 'price_weekly', 'price_monthly']
+
+
+def parse_vehicle_fields(value, columns):
+    """Requested column names (comma separated) checked against columns; all of them if empty"""
+    if not value:
+        return list(columns)
+    fields = [field.strip() for field in value.split(',') if field.strip()]
+    unknown = [field for field in fields if field not in columns]
+    if unknown:
+        raise ValueError(f"Unknown field(s): {', '.join(unknown)}")
+    return fields if 'id' in fields else ['id'] + fields
+
+
+def parse_vehicle_sort(value):
+    """ORDER BY clause for sort=col,-col (descending with a leading minus); id breaks ties"""
+    terms = []
+    for item in (value or 'type,name').split(','):
+        item = item.strip()
+        column = item.lstrip('-')
+        if column not in VEHICLE_API_SORTS:
+            raise ValueError(f'Cannot sort by {column}')
+        terms.append(f"{column} {'DESC' if item.startswith('-') else 'ASC'}")
+    return ', '.join(terms + ['id ASC'])
+
+
+def get_catalog_vehicles(fields, columns=VEHICLE_LIST_COLUMNS, vehicle_id=None, category=None,
+                         vehicle_type=None, min_price=None, max_price=None,
+                         order_by='type ASC, name ASC, id ASC'):
+    """Active vehicles with only the requested columns, filtered on the server"""
+    select = ', '.join(columns[field] if columns[field] == field else f'{columns[field]} AS {field}'
+                       for field in fields)
+    query = f'SELECT {select} FROM vehicles WHERE is_active = 1'
+    params = []
+    
+    if vehicle_id is not None:
+        query += ' AND id = %s'
+        params.append(vehicle_id)
+    
+    if category:
+        query += ' AND category = %s'
+        params.append(category)
+    
+    if vehicle_type:
+        query += ' AND type = %s'
+        params.append(vehicle_type)
+    
+    if min_price is not None:
+        query += ' AND price_day >= %s'
+        params.append(min_price)
+    
+    if max_price is not None:
+        query += ' AND price_day <= %s'
+        params.append(max_price)
+    
+    with get_db_connection() as conn:
+        cursor = get_db_cursor(conn)
+        cursor.execute(query + ' ORDER BY ' + order_by, params)
+        return [dict(row) for row in cursor.fetchall()]
 
 
 # --- PUBLIC ROUTES ---
@@ -394,40 +2376,127 @@ def index():
     start_date = request.args.get('start', '')
     end_date = request.args.get('end', '')
     
-    with get_db_connection() as conn:
-        cursor = get_db_cursor(conn)
-        cursor.execute(
-            'SELECT * FROM vehicles WHERE is_active = 1 AND category = %s ORDER BY type, name',
-            (category,)
-        )
-        vehicles_raw = cursor.fetchall()
-    
-    vehicles = []
-    for vehicle in vehicles_raw:
-        vehicle_dict = dict(vehicle)
+    def render():
+        vehicles_raw = get_catalog_vehicles(list(VEHICLE_LIST_COLUMNS), category=category)
         
+        availability = {}
         if start_date and end_date:
             try:
                 start_dt = datetime.strptime(start_date, '%Y-%m-%d %H:%M')
                 end_dt = datetime.strptime(end_date, '%Y-%m-%d %H:%M')
                 
-                start_str = start_dt.strftime('%Y-%m-%d %H:%M')
-                end_str = end_dt.strftime('%Y-%m-%d %H:%M')
-                
-                vehicle_dict['available'] = check_availability(vehicle['id'], start_str, end_str)
-            except:
-                vehicle_dict['available'] = True
-        else:
-            vehicle_dict['available'] = True
+                availability = check_availability_bulk(
+                    [vehicle['id'] for vehicle in vehicles_raw],
+                    start_dt.strftime('%Y-%m-%d %H:%M'),
+                    end_dt.strftime('%Y-%m-%d %H:%M'))
+            except Exception:
+                availability = {}
         
-        vehicles.append(vehicle_dict)
+        vehicles = []
+        for vehicle in vehicles_raw:
+            vehicle['available'] = availability.get(vehicle['id'], True)
+            vehicles.append(vehicle)
+        
+        return render_template('catalog.html', 
+                             vehicles=vehicles, 
+                             current_category=category,
+                             start_date=start_date,
+                             end_date=end_date,
+                             whatsapp=WHATSAPP_NUMBER)
+    
+    version, changed_at = get_catalog_state()
+    key = (version, 'page', category, start_date, end_date)
+    if start_date and end_date:
+        # Availability reflects bookings as of the render
+        rendered_at = datetime.now(timezone.utc).replace(microsecond=0)
+        return cached_catalog_response(key, render, rendered_at, ttl=CATALOG_WINDOW_CACHE_TTL)
+    return cached_catalog_response(key, render, changed_at)
+
+
+# --- PUBLIC CATALOG API ---
+VEHICLE_API_VERSION = 1
+
+
+def api_error(message, status=400):
+    return jsonify({'success': False, 'message': message}), status
+
+
+def parse_price(value):
+    if value in (None, ''):
+        return None
+    return int(value)
+
+
+@app.route('/api/v1/vehicles')
+@app.route('/api/vehicles')
+def api_vehicles():
+    """Active vehicles as JSON: listing columns only, with server-side filters and sorting.
+
+    Query params: fields, category, type, min_price/max_price (daily price), sort
+    (e.g. -price_day,name), and start/end (YYYY-MM-DD HH:MM) to add an `available` flag.
+    """
+    start_date = request.args.get('start', '')
+    end_date = request.args.get('end', '')
+    try:
+        fields = parse_vehicle_fields(request.args.get('fields'), VEHICLE_LIST_COLUMNS)
+        order_by = parse_vehicle_sort(request.args.get('sort'))
+    except ValueError as e:
+        return api_error(str(e))
     
-    return render_template('catalog.html', 
-                         vehicles=vehicles, 
-                         current_category=category,
-                         start_date=start_date,
-                         end_date=end_date,
-                         whatsapp=WHATSAPP_NUMBER)
+    try:
+        min_price = parse_price(request.args.get('min_price'))
+        max_price = parse_price(request.args.get('max_price'))
+        if start_date or end_date:
+            start_dt = datetime.strptime(start_date, '%Y-%m-%d %H:%M')
+            end_dt = datetime.strptime(end_date, '%Y-%m-%d %H:%M')
+    except ValueError:
+        return api_error('Invalid price or date parameter')
+    
+    category = request.args.get('category') or None
+    vehicle_type = request.args.get('type') or None
+    
+    def render():
+        vehicles = get_catalog_vehicles(fields, category=category, vehicle_type=vehicle_type,
+                                        min_price=min_price, max_price=max_price, order_by=order_by)
+        if start_date:
+            availability = check_availability_bulk([vehicle['id'] for vehicle in vehicles],
+                                                   start_dt.strftime('%Y-%m-%d %H:%M'),
+                                                   end_dt.strftime('%Y-%m-%d %H:%M'))
+            for vehicle in vehicles:
+                vehicle['available'] = availability.get(vehicle['id'], True)
+        return app.json.dumps({'version': VEHICLE_API_VERSION, 'count': len(vehicles), 'vehicles': vehicles})
+    
+    version, changed_at = get_catalog_state()
+    key = (version, 'api-list', tuple(fields), category, vehicle_type, min_price, max_price, order_by,
+           start_date, end_date)
+    if start_date:
+        rendered_at = datetime.now(timezone.utc).replace(microsecond=0)
+        return cached_catalog_response(key, render, rendered_at, ttl=CATALOG_WINDOW_CACHE_TTL,
+                                       mimetype='application/json')
+    return cached_catalog_response(key, render, changed_at, mimetype='application/json')
+
+
+@app.route('/api/v1/vehicles/<int:id>')
+@app.route('/api/vehicles/<int:id>')
+def api_vehicle_detail(id):
+    """One active vehicle including its terms and conditions; ?fields= narrows the columns"""
+    try:
+        fields = parse_vehicle_fields(request.args.get('fields'), VEHICLE_DETAIL_COLUMNS)
+    except ValueError as e:
+        return api_error(str(e))
+    
+    def render():
+        vehicles = get_catalog_vehicles(fields, VEHICLE_DETAIL_COLUMNS, vehicle_id=id)
+        if not vehicles:
+            raise LookupError(id)
+        return app.json.dumps({'version': VEHICLE_API_VERSION, 'vehicle': vehicles[0]})
+    
+    version, changed_at = get_catalog_state()
+    try:
+        return cached_catalog_response((version, 'api-detail', id, tuple(fields)), render, changed_at,
+                                       mimetype='application/json')
+    except LookupError:
+        return api_error('Vehicle not found', 404)
 
 
 # --- AUTHENTICATION ROUTES ---
@@ -552,14 +2621,10 @@ def admin_catalog():
         params.append(category)
     
     if search_query:
-        sql += """ AND (
-            name ILIKE %s OR 
-            license_plate ILIKE %s OR 
-            type ILIKE %s OR 
-            cc::TEXT ILIKE %s
-        )"""
-        search_param = f"%{search_query}%"
-        params.extend([search_param] * 4)
+        condition, search_params = search_condition(
+            search_query, ['name', 'license_plate', 'type', 'cc::TEXT'], fuzzy_columns=['name'])
+        sql += ' AND ' + condition
+        params.extend(search_params)
     
     sql += " ORDER BY is_active DESC, category, name ASC"
     
@@ -587,21 +2652,12 @@ def admin_add_vehicle():
     """Add new vehicle"""
     if request.method == 'POST':
         try:
-            image_path = None
-            if 'image' in request.files:
-                file = request.files['image']
-                if file and file.filename and allowed_file(file.filename):
-                    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-                    filename = secure_filename(f"{timestamp}_{file.filename}")
-                    saved_path = compress_and_save_image(file, filename)
-                    if saved_path:
-                        image_path = f"/static/uploads/vehicles/{filename}"
-            
+            image_job = None
             with get_db_connection() as conn:
                 cursor = get_db_cursor(conn)
                 cursor.execute('''INSERT INTO vehicles 
-                    (name, type, cc, license_plate, category, price_day, price_3day, price_weekly, price_monthly, image_url, terms_and_conditions) 
-                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)''', 
+                    (name, type, cc, license_plate, category, price_day, price_3day, price_weekly, price_monthly, terms_and_conditions) 
+                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s) RETURNING id''', 
                     (request.form['name'],
                      request.form['type'],
                      request.form['cc'],
@@ -611,9 +2667,17 @@ def admin_add_vehicle():
                      request.form['price_3day'],
                      request.form['price_weekly'],
                      request.form['price_monthly'],
-                     image_path,
                      request.form.get('terms_and_conditions', '')))
+                vehicle_id = cursor.fetchone()['id']
+                
+                if 'image' in request.files:
+                    file = request.files['image']
+                    if file and file.filename and allowed_file(file.filename):
+                        image_job = queue_image_job(cursor, 'vehicle', vehicle_id, file)
             
+            if image_job:
+                start_image_job(image_job)
+            on_vehicles_changed()
             flash('Vehicle added successfully!', 'success')
             return redirect(url_for('admin_catalog'))
         except psycopg2.IntegrityError as e:
@@ -645,27 +2709,18 @@ def admin_edit_vehicle(id):
     if request.method == 'POST':
         try:
             image_path = vehicle['image_url']
-            
-            if 'image' in request.files:
-                file = request.files['image']
-                if file and file.filename and allowed_file(file.filename):
-                    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-                    filename = secure_filename(f"{timestamp}_{file.filename}")
-                    
-                    new_image_path = compress_and_save_image(file, filename)
-                    if new_image_path:
-                        if image_path and image_path.startswith('/static/'):
-                            old_path = image_path.lstrip('/')
-                            if os.path.exists(old_path):
-                                try:
-                                    os.remove(old_path)
-                                except:
-                                    pass
-                        
-                        image_path = f"/static/uploads/vehicles/{filename}"
+            image_job = None
             
             with get_db_connection() as conn:
                 cursor = get_db_cursor(conn)
+                
+                # The old image is removed by the job once the new one is published
+                if 'image' in request.files:
+                    file = request.files['image']
+                    if file and file.filename and allowed_file(file.filename):
+                        image_job = queue_image_job(cursor, 'vehicle', id, file, replaces_url=image_path)
+                        image_path = image_job['placeholder']
+                
                 cursor.execute('''UPDATE vehicles SET 
                     name=%s, type=%s, cc=%s, license_plate=%s, category=%s,
                     price_day=%s, price_3day=%s, price_weekly=%s, price_monthly=%s, 
@@ -684,6 +2739,9 @@ def admin_edit_vehicle(id):
                      request.form.get('terms_and_conditions', ''),
                      id))
             
+            if image_job:
+                start_image_job(image_job)
+            on_vehicles_changed()
             flash('Vehicle updated successfully!', 'success')
             return redirect(url_for('admin_detail', id=id))
         except psycopg2.IntegrityError as e:
@@ -717,6 +2775,7 @@ def admin_toggle_vehicle(id):
         else:
             flash('Vehicle not found!', 'error')
     
+    on_vehicles_changed()
     return redirect(url_for('admin_catalog'))
 
 
@@ -742,80 +2801,409 @@ def admin_detail(id):
     current_year = datetime.now().year
     current_month = datetime.now().month
     
-    calendar_data = get_calendar_data(id, current_year, current_month)
+    # Whole year in one pass so month navigation in the page needs no round trips
+    calendar_year = get_calendar_range(id, current_year, 1, 12)
+    calendar_data = calendar_year[current_month - 1]
+    
+    return render_template('admin_detail.html', 
+                         vehicle=vehicle, 
+                         bookings=bookings,
+                         current_year=current_year,
+                         current_month=current_month,
+                         calendar_data=calendar_data,
+                         calendar_year=calendar_year)
+
+
+@app.route('/admin/vehicle/<int:id>/calendar/<int:year>/<int:month>')
+@login_required
+def get_vehicle_calendar(id, year, month):
+    """Get calendar data"""
+    calendar_data = get_calendar_data(id, year, month)
+    return jsonify(calendar_data)
+
+
+@app.route('/admin/vehicle/<int:id>/calendar/<int:year>')
+@login_required
+def get_vehicle_calendar_year(id, year):
+    """Get calendar data for all twelve months of a year"""
+    return jsonify({'year': year, 'months': get_calendar_range(id, year, 1, 12)})
+
+
+# --- FLEET TIMELINE ---
+FLEET_TIMELINE_MAX_DAYS = 366
+
+
+def encode_runs(bits):
+    """Run-length encode a 0/1 list as alternating run lengths, starting with a free (0) run"""
+    runs = []
+    current = 0
+    length = 0
+    for bit in bits:
+        if bit == current:
+            length += 1
+        else:
+            runs.append(length)
+            current = bit
+            length = 1
+    runs.append(length)
+    return runs
+
+
+def get_active_vehicles(category='all', vehicle_type='all'):
+    """Active vehicles (id, name, plate, type, category), optionally filtered"""
+    query = '''
+        SELECT id, name, license_plate, type, category
+        FROM vehicles
+        WHERE is_active = 1
+    '''
+    params = []
+    
+    if category != 'all':
+        query += ' AND category = %s'
+        params.append(category)
+    
+    if vehicle_type != 'all':
+        query += ' AND type = %s'
+        params.append(vehicle_type)
+    
+    query += ' ORDER BY category, type, name, id'
+    
+    with get_db_connection() as conn:
+        cursor = get_db_cursor(conn)
+        cursor.execute(query, params)
+        return [dict(row) for row in cursor.fetchall()]
+
+
+def parse_slot_bound(value, is_end=False):
+    """(date, half) for a YYYY-MM-DD[ HH:MM] bound; bare dates cover the whole day"""
+    try:
+        moment = datetime.strptime(value, '%Y-%m-%d %H:%M')
+    except (TypeError, ValueError):
+        moment = datetime.strptime(value or '', '%Y-%m-%d')
+        return moment.date(), 1 if is_end else 0
+    if is_end:
+        return moment.date(), 1 if moment.hour > 12 else 0
+    return moment.date(), 0 if moment.hour < 12 else 1
+
+
+@app.route('/admin/fleet/timeline')
+@login_required
+def admin_fleet_timeline():
+    """Half-day occupancy of every active vehicle over a date window (JSON)"""
+    category = request.args.get('category', 'all')
+    vehicle_type = request.args.get('type', 'all')
+    encoding = request.args.get('encoding', 'rle')
+    
+    try:
+        start = datetime.strptime(request.args.get('start', datetime.now().strftime('%Y-%m-%d')), '%Y-%m-%d')
+        days = min(max(int(request.args.get('days', 30)), 1), FLEET_TIMELINE_MAX_DAYS)
+    except ValueError:
+        return jsonify({'success': False, 'message': 'Invalid start or days'}), 400
+    
+    if encoding not in ('rle', 'bits'):
+        return jsonify({'success': False, 'message': 'encoding must be rle or bits'}), 400
+    
+    first_date = start.date()
+    last_date = first_date + timedelta(days=days - 1)
+    vehicles = get_active_vehicles(category, vehicle_type)
+    bitmaps = get_slot_bitmaps([vehicle['id'] for vehicle in vehicles],
+                               first_date.replace(day=1), add_months(last_date, 1))
+    
+    for vehicle in vehicles:
+        slots = window_slots(bitmaps[vehicle['id']], first_date, days)
+        # Bit i is half-day i from the window start, so the reversed binary string reads forwards
+        bits = format(slots, f'0{2 * days}b')[::-1]
+        vehicle['booked_slots'] = bits.count('1')
+        if encoding == 'rle':
+            vehicle['occupancy'] = encode_runs(int(bit) for bit in bits)
+        else:
+            vehicle['occupancy'] = bits
+    
+    return jsonify({
+        'start': start.strftime('%Y-%m-%d'),
+        'days': days,
+        'slots_per_day': 2,
+        'encoding': encoding,
+        'vehicles': vehicles
+    })
+
+
+@app.route('/admin/fleet/free')
+@login_required
+def admin_fleet_free():
+    """Active vehicles with no booked half-day between start and end (JSON).
+
+    start/end are YYYY-MM-DD (whole days) or YYYY-MM-DD HH:MM (from/until that half-day).
+    """
+    category = request.args.get('category', 'all')
+    vehicle_type = request.args.get('type', 'all')
+    
+    try:
+        first_date, first_half = parse_slot_bound(request.args.get('start'))
+        last_date, last_half = parse_slot_bound(request.args.get('end', request.args.get('start')), is_end=True)
+    except ValueError:
+        return jsonify({'success': False, 'message': 'Invalid start or end'}), 400
+    
+    if (last_date, last_half) < (first_date, first_half) or \
+            (last_date - first_date).days >= FLEET_TIMELINE_MAX_DAYS:
+        return jsonify({'success': False, 'message': 'Invalid date range'}), 400
+    
+    masks = slot_masks_by_month(first_date, first_half, last_date, last_half)
+    vehicles = get_active_vehicles(category, vehicle_type)
+    bitmaps = get_slot_bitmaps([vehicle['id'] for vehicle in vehicles],
+                               first_date.replace(day=1), add_months(last_date, 1))
+    
+    free = [vehicle for vehicle in vehicles
+            if not any(bitmaps[vehicle['id']].get(month, 0) & mask for month, mask in masks.items())]
+    
+    return jsonify({
+        'start': request.args.get('start'),
+        'end': request.args.get('end', request.args.get('start')),
+        'vehicles': free
+    })
+
+
+# --- FLEET UTILIZATION ---
+UTILIZATION_MAX_DAYS = 366
+UTILIZATION_PEAK_DAYS = 10
+HALF_DAY_SECONDS = 12 * 3600
+
+
+def rasterize_half_days(rows, start_slots, end_slots, num_vehicles, num_slots):
+    """Vehicles x half-day-slots boolean matrix from per-booking slot positions.
+
+    A booking occupies every slot from the one containing its start to the one containing
+    its last instant. Slots are painted with a difference array and one cumulative sum,
+    so the cost is O(bookings + vehicles * slots) with no Python-level loop.
+    """
+    import numpy as np  # only the utilization report needs numpy
+    
+    first = np.floor(start_slots).astype(np.int64)
+    last = np.ceil(end_slots).astype(np.int64) - 1
+    keep = (last >= 0) & (first < num_slots) & (last >= first)
+    rows, first, last = rows[keep], np.clip(first[keep], 0, None), np.clip(last[keep], None, num_slots - 1)
+    
+    diff = np.zeros((num_vehicles, num_slots + 1), dtype=np.int32)
+    np.add.at(diff, (rows, first), 1)
+    np.add.at(diff, (rows, last + 1), -1)
+    return np.cumsum(diff[:, :num_slots], axis=1) > 0
+
+
+def longest_idle_runs(occupied):
+    """Length and starting slot of each row's longest run of free slots"""
+    import numpy as np
+    
+    num_vehicles, num_slots = occupied.shape
+    padded = np.ones((num_vehicles, num_slots + 2), dtype=np.int8)
+    padded[:, 1:-1] = occupied
+    edges = np.diff(padded, axis=1)
+    # nonzero() walks row-major, so the i-th run start and end belong to the same run
+    run_rows, run_starts = np.nonzero(edges == -1)
+    _, run_ends = np.nonzero(edges == 1)
+    lengths = run_ends - run_starts
+    
+    longest = np.zeros(num_vehicles, dtype=np.int64)
+    longest_start = np.full(num_vehicles, -1, dtype=np.int64)
+    if lengths.size:
+        # Sort by (row, length) so the last entry per row is its longest run
+        order = np.lexsort((-run_starts, lengths, run_rows))
+        last_per_row = np.r_[run_rows[order][1:] != run_rows[order][:-1], True]
+        best = order[last_per_row]
+        longest[run_rows[best]] = lengths[best]
+        longest_start[run_rows[best]] = run_starts[best]
+    return longest, longest_start
+
+
+def group_occupancy(occupied_slots, codes, num_groups, num_slots):
+    """Occupancy ratio per group, given each vehicle's occupied slot count and group code"""
+    import numpy as np
+    
+    booked = np.bincount(codes, weights=occupied_slots, minlength=num_groups)
+    capacity = np.bincount(codes, minlength=num_groups) * num_slots
+    return booked / np.maximum(capacity, 1)
+
+
+def get_fleet_utilization(start, days, category='all', vehicle_type='all'):
+    """Occupancy, idle streaks and peak-demand days for active vehicles over a window"""
+    import numpy as np
+    
+    end = start + timedelta(days=days)
+    num_slots = days * 2
+    
+    query = '''
+        SELECT v.id, v.name, v.license_plate, v.type, v.category,
+               (EXTRACT(EPOCH FROM lower(b.rental_period) - %s) / %s)::float8 AS start_slot,
+               (EXTRACT(EPOCH FROM upper(b.rental_period) - %s) / %s)::float8 AS end_slot
+        FROM vehicles v
+        LEFT JOIN bookings b ON b.vehicle_id = v.id
+            AND b.status != 'cancelled'
+            AND b.rental_period && tsrange(%s, %s, '[)')
+        WHERE v.is_active = 1
+    '''
+    params = [start, HALF_DAY_SECONDS, start, HALF_DAY_SECONDS, start, end]
+    
+    if category != 'all':
+        query += ' AND v.category = %s'
+        params.append(category)
+    
+    if vehicle_type != 'all':
+        query += ' AND v.type = %s'
+        params.append(vehicle_type)
+    
+    query += ' ORDER BY v.category, v.type, v.name, v.id'
+    
+    with get_db_connection() as conn:
+        cursor = get_db_cursor(conn)
+        cursor.execute(query, params)
+        result = cursor.fetchall()
+    
+    vehicles = []
+    vehicle_rows = {}
+    booking_rows, start_slots, end_slots = [], [], []
+    for row in result:
+        if row['id'] not in vehicle_rows:
+            vehicle_rows[row['id']] = len(vehicles)
+            vehicles.append({key: row[key] for key in ('id', 'name', 'license_plate', 'type', 'category')})
+        if row['start_slot'] is not None:
+            booking_rows.append(vehicle_rows[row['id']])
+            start_slots.append(row['start_slot'])
+            end_slots.append(row['end_slot'])
+    
+    occupied = rasterize_half_days(np.array(booking_rows, dtype=np.int64),
+                                   np.array(start_slots, dtype=np.float64),
+                                   np.array(end_slots, dtype=np.float64),
+                                   len(vehicles), num_slots)
+    
+    occupied_slots = occupied.sum(axis=1)
+    longest_idle, idle_start = longest_idle_runs(occupied)
+    for i, vehicle in enumerate(vehicles):
+        vehicle['occupied_half_days'] = int(occupied_slots[i])
+        vehicle['occupancy'] = round(float(occupied_slots[i]) / num_slots, 4)
+        vehicle['longest_idle_half_days'] = int(longest_idle[i])
+        vehicle['longest_idle_from'] = ((start + timedelta(hours=12 * int(idle_start[i]))).strftime('%Y-%m-%d %H:%M')
+                                        if idle_start[i] >= 0 else None)
+    
+    groups = {}
+    for field in ('type', 'category'):
+        names, codes = np.unique(np.array([v[field] or '' for v in vehicles], dtype=object), return_inverse=True)
+        ratios = group_occupancy(occupied_slots, codes.astype(np.int64), len(names), num_slots)
+        counts = np.bincount(codes.astype(np.int64), minlength=len(names))
+        groups[field] = [{'name': name, 'vehicles': int(count), 'occupancy': round(float(ratio), 4)}
+                         for name, count, ratio in zip(names, counts, ratios)]
+    
+    # A vehicle counts as booked on a day if either half is taken
+    booked_per_day = occupied.reshape(len(vehicles), days, 2).any(axis=2).sum(axis=0)
+    peak = np.argsort(-booked_per_day, kind='stable')[:UTILIZATION_PEAK_DAYS]
+    fleet_size = max(len(vehicles), 1)
+    
+    return {
+        'start': start.strftime('%Y-%m-%d'),
+        'days': days,
+        'category': category,
+        'type': vehicle_type,
+        'vehicles': vehicles,
+        'fleet': {
+            'vehicles': len(vehicles),
+            'occupied_half_days': int(occupied_slots.sum()),
+            'occupancy': round(float(occupied_slots.sum()) / (fleet_size * num_slots), 4),
+        },
+        'by_type': groups['type'],
+        'by_category': groups['category'],
+        'daily': [{'date': (start + timedelta(days=int(day))).strftime('%Y-%m-%d'),
+                   'vehicles_booked': int(booked_per_day[day])} for day in range(days)],
+        'peak_days': [{'date': (start + timedelta(days=int(day))).strftime('%Y-%m-%d'),
+                       'vehicles_booked': int(booked_per_day[day]),
+                       'occupancy': round(float(booked_per_day[day]) / fleet_size, 4)}
+                      for day in peak if booked_per_day[day] > 0],
+    }
+
+
+@app.route('/admin/reports/utilization')
+@login_required
+def admin_utilization_report():
+    """Fleet utilization report; ?format=json returns the same data for other tools"""
+    category = request.args.get('category', 'all')
+    vehicle_type = request.args.get('type', 'all')
+    today = datetime.now()
+    
+    try:
+        start = datetime.strptime(request.args.get('start', today.replace(day=1).strftime('%Y-%m-%d')), '%Y-%m-%d')
+        days = min(max(int(request.args.get('days', 30)), 1), UTILIZATION_MAX_DAYS)
+    except ValueError:
+        if request.args.get('format') == 'json':
+            return jsonify({'success': False, 'message': 'Invalid start or days'}), 400
+        flash('Invalid start date or number of days', 'error')
+        return redirect(url_for('admin_utilization_report'))
+    
+    try:
+        report = get_fleet_utilization(start, days, category, vehicle_type)
+    except ImportError:
+        if request.args.get('format') == 'json':
+            return jsonify({'success': False, 'message': 'Utilization report requires numpy'}), 503
+        flash('Utilization report requires numpy (pip install numpy)', 'error')
+        return redirect(url_for('admin_catalog'))
+    if request.args.get('format') == 'json':
+        return jsonify(report)
+    
+    with get_db_connection() as conn:
+        cursor = get_db_cursor(conn)
+        cursor.execute('SELECT DISTINCT category FROM vehicles WHERE category IS NOT NULL ORDER BY category')
+        categories = [row['category'] for row in cursor.fetchall()]
+        cursor.execute('SELECT DISTINCT type FROM vehicles WHERE type IS NOT NULL ORDER BY type')
+        types = [row['type'] for row in cursor.fetchall()]
     
-    return render_template('admin_detail.html', 
-                         vehicle=vehicle, 
-                         bookings=bookings,
-                         current_year=current_year,
-                         current_month=current_month,
-                         calendar_data=calendar_data)
+    return render_template('admin_utilization.html',
+                         report=report,
+                         categories=categories,
+                         types=types)
 
 
-@app.route('/admin/vehicle/<int:id>/calendar/<int:year>/<int:month>')
-@login_required
-def get_vehicle_calendar(id, year, month):
-    """Get calendar data"""
-    calendar_data = get_calendar_data(id, year, month)
-    return jsonify(calendar_data)
+# --- ON RENT ROUTE ---
+ON_RENT_OVERDUE_LOOKBACK_DAYS = 7  # overdue rentals older than this are left to the bookings page
 
 
-# --- ON RENT ROUTE ---
 @app.route('/admin/on-rent')
 @login_required
 def admin_on_rent():
-    """View currently rented vehicles - SIMPLIFIED VERSION"""
+    """View currently rented vehicles, plus recently overdue rentals not yet completed"""
+    now = datetime.now()
+    tomorrow = datetime(now.year, now.month, now.day) + timedelta(days=1)
     
-    # Get ALL confirmed/pending bookings first
+    # Rentals overlapping [now - lookback, now]: everything out right now, plus anything
+    # that should have come back recently but is still confirmed/pending
     query = '''
         SELECT 
             b.*, 
             v.name as vehicle_name, 
             v.license_plate, 
             v.type as vehicle_type, 
-            v.category
+            v.category,
+            CASE
+                WHEN upper(b.rental_period) <= %(now)s THEN 'overdue'
+                WHEN upper(b.rental_period) < %(tomorrow)s THEN 'returning_today'
+                ELSE 'on_rent'
+            END AS rent_bucket
         FROM bookings b
         JOIN vehicles v ON b.vehicle_id = v.id
         WHERE b.status IN ('confirmed', 'pending')
-        ORDER BY b.end_date ASC, b.return_time ASC
+        AND b.rental_period && tsrange(%(overdue_since)s, %(now)s, '[]')
+        ORDER BY upper(b.rental_period) ASC
     '''
     
     with get_db_connection() as conn:
         cursor = get_db_cursor(conn)
-        cursor.execute(query)
-        all_bookings = cursor.fetchall()
-    
-    # Filter di Python instead of SQL (lebih reliable)
-    from datetime import datetime
-    now = datetime.now()
-    
-    on_rent = []
-    for booking in all_bookings:
-        try:
-            # Parse start datetime
-            start_dt = datetime.strptime(
-                f"{booking['start_date']} {booking['pickup_time']}", 
-                '%Y-%m-%d %H:%M'
-            )
-            
-            # Parse end datetime
-            end_dt = datetime.strptime(
-                f"{booking['end_date']} {booking['return_time']}", 
-                '%Y-%m-%d %H:%M'
-            )
-            
-            # Check if currently on rent
-            if start_dt <= now <= end_dt:
-                on_rent.append(booking)
-                print(f"✅ ON RENT: {booking['booking_number']} - {booking['vehicle_name']}")
-        except Exception as e:
-            print(f"❌ Error parsing booking {booking.get('id')}: {e}")
-            continue
+        cursor.execute(query, {
+            'now': now,
+            'tomorrow': tomorrow,
+            'overdue_since': now - timedelta(days=ON_RENT_OVERDUE_LOOKBACK_DAYS)
+        })
+        bookings = cursor.fetchall()
     
-    print(f"\n📊 Total confirmed/pending: {len(all_bookings)}")
-    print(f"🔄 Currently on rent: {len(on_rent)}")
+    summary = {'on_rent': 0, 'returning_today': 0, 'overdue': 0}
+    for booking in bookings:
+        summary[booking['rent_bucket']] += 1
     
-    return render_template('admin_on_rent.html', bookings=on_rent)
+    return render_template('admin_on_rent.html', bookings=bookings, summary=summary)
 
 
 # --- BOOKING ROUTES ---
@@ -833,34 +3221,24 @@ def admin_add_booking(vehicle_id):
                 flash('Vehicle not found!', 'error')
                 return redirect(url_for('admin_catalog'))
             
-            booking_number = generate_booking_number()
-            
-            customer_photo_path = None
-            if 'customer_photo' in request.files:
-                file = request.files['customer_photo']
-                if file and file.filename and allowed_file(file.filename):
-                    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-                    filename = secure_filename(f"customer_{timestamp}_{file.filename}")
-                    saved_path = compress_and_save_image(file, filename, CUSTOMER_PHOTO_FOLDER)
-                    if saved_path:
-                        customer_photo_path = f"/static/uploads/customers/{filename}"
-            
             total_price = request.form.get('total_price', '')
             try:
                 total_price = float(total_price) if total_price else None
             except:
                 total_price = None
             
+            # Allocated last: the day's counter row stays locked until this transaction commits
+            booking_number = generate_booking_number()
+            
             cursor.execute('''INSERT INTO bookings 
-                (booking_number, vehicle_id, customer_name, ic_number, nationality, customer_photo, location, destination,
+                (booking_number, vehicle_id, customer_name, ic_number, nationality, location, destination,
                  start_date, pickup_time, end_date, return_time, total_price, status) 
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)''', 
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s) RETURNING id''', 
                 (booking_number,
                  vehicle_id,
                  request.form['customer_name'],
                  request.form.get('ic_number', ''),
                  request.form.get('nationality', 'Malaysian'),
-                 customer_photo_path,
                  request.form.get('location', ''),
                  request.form.get('destination', ''),
                  request.form['start_date'],
@@ -869,8 +3247,27 @@ def admin_add_booking(vehicle_id):
                  request.form['return_time'],
                  total_price,
                  request.form.get('status', 'confirmed')))
+            booking_id = cursor.fetchone()['id']
+            
+            image_job = None
+            if 'customer_photo' in request.files:
+                file = request.files['customer_photo']
+                if file and file.filename and allowed_file(file.filename):
+                    image_job = queue_image_job(cursor, 'customer', booking_id, file)
         
+        if image_job:
+            start_image_job(image_job)
+        on_bookings_changed()
         flash(f'Booking added! Number: {booking_number}', 'success')
+    except psycopg2.IntegrityError as e:
+        if 'bookings_no_overlap' in str(e):
+            flash('Vehicle is already booked for that period!', 'error')
+        elif 'bookings_valid_period' in str(e):
+            flash('Return date and time must be after pickup!', 'error')
+        else:
+            flash(f'Error: {str(e)}', 'error')
+    except psycopg2.DataError:
+        flash('Invalid booking date or time!', 'error')
     except Exception as e:
         flash(f'Error: {str(e)}', 'error')
     
@@ -892,23 +3289,13 @@ def admin_edit_booking(id):
                 return redirect(url_for('admin_catalog'))
             
             customer_photo_path = booking['customer_photo']
+            image_job = None
+            # The old photo is removed by the job once the new one is published
             if 'customer_photo' in request.files:
                 file = request.files['customer_photo']
                 if file and file.filename and allowed_file(file.filename):
-                    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-                    filename = secure_filename(f"customer_{timestamp}_{file.filename}")
-                    
-                    saved_path = compress_and_save_image(file, filename, CUSTOMER_PHOTO_FOLDER)
-                    if saved_path:
-                        if customer_photo_path and customer_photo_path.startswith('/static/'):
-                            old_path = customer_photo_path.lstrip('/')
-                            if os.path.exists(old_path):
-                                try:
-                                    os.remove(old_path)
-                                except:
-                                    pass
-                        
-                        customer_photo_path = f"/static/uploads/customers/{filename}"
+                    image_job = queue_image_job(cursor, 'customer', id, file, replaces_url=customer_photo_path)
+                    customer_photo_path = image_job['placeholder']
             
             total_price = request.form.get('total_price', '')
             try:
@@ -934,8 +3321,22 @@ def admin_edit_booking(id):
                  request.form.get('status', 'confirmed'),
                  id))
         
+        if image_job:
+            start_image_job(image_job)
+        on_bookings_changed()
         flash('Booking updated!', 'success')
         return redirect(url_for('admin_detail', id=booking['vehicle_id']))
+    except psycopg2.IntegrityError as e:
+        if 'bookings_no_overlap' in str(e):
+            flash('Vehicle is already booked for that period!', 'error')
+        elif 'bookings_valid_period' in str(e):
+            flash('Return date and time must be after pickup!', 'error')
+        else:
+            flash(f'Error: {str(e)}', 'error')
+        return redirect(request.referrer or url_for('admin_catalog'))
+    except psycopg2.DataError:
+        flash('Invalid booking date or time!', 'error')
+        return redirect(request.referrer or url_for('admin_catalog'))
     except Exception as e:
         flash(f'Error: {str(e)}', 'error')
         return redirect(request.referrer or url_for('admin_catalog'))
@@ -947,24 +3348,18 @@ def admin_delete_booking(id):
     """Delete booking"""
     with get_db_connection() as conn:
         cursor = get_db_cursor(conn)
-        cursor.execute('SELECT vehicle_id, customer_photo FROM bookings WHERE id = %s', (id,))
+        cursor.execute('DELETE FROM bookings WHERE id = %s RETURNING vehicle_id, customer_photo', (id,))
         booking = cursor.fetchone()
-        
-        if booking:
-            if booking['customer_photo'] and booking['customer_photo'].startswith('/static/'):
-                photo_path = booking['customer_photo'].lstrip('/')
-                if os.path.exists(photo_path):
-                    try:
-                        os.remove(photo_path)
-                    except:
-                        pass
-            
-            cursor.execute('DELETE FROM bookings WHERE id = %s', (id,))
-            flash('Booking deleted!', 'success')
-            return redirect(url_for('admin_detail', id=booking['vehicle_id']))
     
-    flash('Booking not found!', 'error')
-    return redirect(url_for('admin_catalog'))
+    if not booking:
+        flash('Booking not found!', 'error')
+        return redirect(url_for('admin_catalog'))
+    
+    # The photo may be shared with other bookings; it is only deleted once unreferenced
+    release_upload(booking['customer_photo'])
+    on_bookings_changed()
+    flash('Booking deleted!', 'success')
+    return redirect(url_for('admin_detail', id=booking['vehicle_id']))
 
 
 @app.route('/admin/booking/<int:id>/update-status', methods=['POST'])
@@ -982,94 +3377,248 @@ def admin_update_booking_status(id):
             cursor = get_db_cursor(conn)
             cursor.execute('UPDATE bookings SET status = %s WHERE id = %s', (new_status, id))
         
+        on_bookings_changed()
         return jsonify({'success': True, 'message': 'Status updated successfully'})
+    except psycopg2.IntegrityError as e:
+        if 'bookings_no_overlap' in str(e):
+            return jsonify({'success': False, 'message': 'Vehicle is already booked for that period'}), 409
+        return jsonify({'success': False, 'message': str(e)}), 500
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
 
 
 # --- ALL BOOKINGS (OPTIMIZED) ---
-@app.route('/admin/bookings')
-@login_required
-def admin_all_bookings():
-    """Optimized all bookings with pagination"""
-    status_filter = request.args.get('status', 'all')
-    vehicle_filter = request.args.get('vehicle', 'all')
-    search_query = request.args.get('search', '')
-    sort_by = request.args.get('sort', 'newest')
-    page = int(request.args.get('page', 1))
-    
-    current_month = datetime.now().strftime('%Y-%m')
-    month_filter = request.args.get('month', current_month)
-    show_all = request.args.get('show_all', '0') == '1'
+# Keyset sort definitions: sort key column and direction; b.id breaks ties in the same direction
+BOOKING_SORTS = {
+    'newest': ('created_at', 'DESC'),
+    'oldest': ('created_at', 'ASC'),
+    'start_date': ('start_date', 'DESC'),
+    'customer': ('customer_name', 'ASC'),
+}
+
+
+def encode_cursor(sort_by, values):
+    """Opaque URL-safe pagination cursor from a sort name and its [sort key, id] values"""
+    raw = json.dumps([sort_by] + [v.isoformat() if isinstance(v, datetime) else v for v in values])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, sort_by):
+    """Inverse of encode_cursor: [sort key, id], or None for a missing, malformed or other-sort cursor.
+
+    The values go straight into a row comparison, so they are checked against the sort column's type.
+    """
+    if not cursor:
+        return None
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        if not isinstance(values, list) or len(values) != 3 or values[0] != sort_by:
+            return None
+        key, booking_id = values[1:]
+        if type(booking_id) is not int:
+            return None
+        if BOOKING_SORTS[sort_by][0] == 'created_at':
+            return [datetime.fromisoformat(key), booking_id]
+        return [key, booking_id] if isinstance(key, str) else None
+    except (ValueError, TypeError):
+        return None
+
+
+def selected_month(args):
+    """The ?month= filter as 'YYYY-MM' (current month when missing or malformed, '' for no month filter)"""
+    month_filter = args.get('month')
+    if month_filter == '':
+        return ''
+    try:
+        month_start, _ = month_bounds(*map(int, month_filter.split('-')))
+        return month_start.strftime('%Y-%m')
+    except (ValueError, TypeError, AttributeError):
+        return datetime.now().strftime('%Y-%m')
+
+
+def build_bookings_filter(args):
+    """WHERE clause and params for the booking filters shared by the bookings views"""
+    status_filter = args.get('status', 'all')
+    vehicle_filter = args.get('vehicle', 'all')
+    search_query = args.get('search', '')
+    month_filter = selected_month(args)
+    show_all = args.get('show_all', '0') == '1'
+    include_overlapping = args.get('overlap', '0') == '1'
     
-    query = '''
-        SELECT b.*, v.name as vehicle_name, v.license_plate, v.type as vehicle_type
-        FROM bookings b
-        JOIN vehicles v ON b.vehicle_id = v.id
-        WHERE 1=1
-    '''
+    where = ' WHERE 1=1'
     params = []
     
     if not show_all and month_filter:
-        query += ' AND SUBSTRING(b.start_date FROM 1 FOR 7) = %s'
-        params.append(month_filter)
+        month_start, next_month = month_bounds(*map(int, month_filter.split('-')))
+        if include_overlapping:
+            # Any rental touching the month, including ones that straddle its boundaries (GiST)
+            period_condition = "b.rental_period && tsrange(%s, %s, '[)')"
+        else:
+            # Rentals starting in the month: half-open range on the btree lower() index
+            period_condition = 'lower(b.rental_period) >= %s AND lower(b.rental_period) < %s'
+        # Legacy bookings whose dates never parsed have no period; match them on the raw start date
+        where += f" AND ({period_condition} OR (b.rental_period IS NULL AND b.start_date LIKE %s))"
+        params.extend([month_start, next_month, f"{month_filter}%"])
     
     if status_filter != 'all':
-        query += ' AND b.status = %s'
+        where += ' AND b.status = %s'
         params.append(status_filter)
     
     if vehicle_filter and vehicle_filter != 'all':
         try:
-            query += ' AND b.vehicle_id = %s'
             params.append(int(vehicle_filter))
+            where += ' AND b.vehicle_id = %s'
         except (ValueError, TypeError):
             pass
     
     if search_query:
-        query += ''' AND (
-            b.booking_number ILIKE %s OR 
-            b.customer_name ILIKE %s OR 
-            b.ic_number ILIKE %s OR
-            v.name ILIKE %s OR
-            v.license_plate ILIKE %s
+        # Every branch is on bookings so the trigram/btree indexes can be BitmapOr-ed;
+        # matching vehicle ids are resolved once by the ARRAY(...) init plan
+        booking_condition, booking_params = search_condition(
+            search_query, ['b.booking_number', 'b.customer_name', 'b.ic_number'],
+            fuzzy_columns=['b.customer_name'])
+        vehicle_condition, vehicle_params = search_condition(
+            search_query, ['name', 'license_plate'], fuzzy_columns=['name'])
+        where += f''' AND (
+            {booking_condition} OR
+            b.vehicle_id = ANY(ARRAY(SELECT id FROM vehicles WHERE {vehicle_condition}))
         )'''
-        search_param = f'%{search_query}%'
-        params.extend([search_param] * 5)
+        params.extend(booking_params + vehicle_params)
+    
+    return where, params
+
+
+# --- BOOKING STATISTICS ---
+BOOKING_STATUSES = ['confirmed', 'pending', 'cancelled', 'completed']
+BOOKING_STATS_CACHE_TTL = 60  # seconds; bounds staleness of writes made by other workers
+BOOKING_STATS_CACHE_MAX = 256
+_booking_stats_cache = {}  # (where, params) -> (expires_at, stats)
+_booking_stats_lock = threading.Lock()
+
+
+def get_booking_stats(args):
+    """Status counts for the bookings matching the shared filters, cached per filter set"""
+    where, params = build_bookings_filter(args)
+    key = (where, tuple(params))
+    now = time.monotonic()
+    
+    with _booking_stats_lock:
+        cached = _booking_stats_cache.get(key)
+        if cached and cached[0] > now:
+            return dict(cached[1])
+    
+    counts = ',\n'.join(
+        f"COUNT(*) FILTER (WHERE b.status = '{status}') AS {status}" for status in BOOKING_STATUSES)
+    with get_db_connection() as conn:
+        cursor = get_db_cursor(conn)
+        cursor.execute(f'''
+            SELECT COUNT(*) AS total,
+            {counts}
+            FROM bookings b
+            JOIN vehicles v ON b.vehicle_id = v.id
+        ''' + where, params)
+        stats = dict(cursor.fetchone())
+    
+    with _booking_stats_lock:
+        if len(_booking_stats_cache) >= BOOKING_STATS_CACHE_MAX:
+            _booking_stats_cache.clear()
+        _booking_stats_cache[key] = (now + BOOKING_STATS_CACHE_TTL, stats)
+    return dict(stats)
+
+
+def on_bookings_changed():
+    """Invalidate this worker's booking-derived caches after a booking write"""
+    booking_index.mark_stale()
+    with _booking_stats_lock:
+        _booking_stats_cache.clear()
+    with _catalog_cache_lock:
+        # Entries with a TTL carry availability; plain catalog entries don't depend on bookings
+        for key in [key for key, entry in _catalog_cache.items() if entry['expires_at'] is not None]:
+            del _catalog_cache[key]
+
+
+@app.route('/admin/bookings')
+@login_required
+def admin_all_bookings():
+    """All bookings with keyset pagination.
+
+    `after`/`before` carry the sort key of the last/first row shown, so each page is a
+    bounded index range scan instead of an OFFSET. The total and status counts come
+    from the cached stats aggregate.
+    """
+    status_filter = request.args.get('status', 'all')
+    vehicle_filter = request.args.get('vehicle', 'all')
+    search_query = request.args.get('search', '')
+    sort_by = request.args.get('sort', 'newest')
+    if sort_by not in BOOKING_SORTS:
+        sort_by = 'newest'
+    try:
+        page = max(int(request.args.get('page', 1)), 1)
+    except ValueError:
+        page = 1
+    
+    month_filter = selected_month(request.args)
+    show_all = request.args.get('show_all', '0') == '1'
+    include_overlapping = request.args.get('overlap', '0') == '1'
+    
+    after = decode_cursor(request.args.get('after'), sort_by)
+    before = None if after else decode_cursor(request.args.get('before'), sort_by)
+    
+    base_query = '''
+        SELECT b.*, v.name as vehicle_name, v.license_plate, v.type as vehicle_type
+        FROM bookings b
+        JOIN vehicles v ON b.vehicle_id = v.id
+    '''
+    where, params = build_bookings_filter(request.args)
+    
+    sort_column, direction = BOOKING_SORTS[sort_by]
+    # Walking backwards flips both the comparison and the ORDER BY; rows are reversed after
+    backwards = before is not None
+    descending = (direction == 'DESC') != backwards
+    comparison = '<' if descending else '>'
+    order = 'DESC' if descending else 'ASC'
+    
+    page_query = base_query + where
+    page_params = list(params)
+    keyset = after or before
+    if keyset:
+        page_query += f' AND (b.{sort_column}, b.id) {comparison} (%s, %s)'
+        page_params.extend(keyset)
+    page_query += f' ORDER BY b.{sort_column} {order}, b.id {order} LIMIT {ITEMS_PER_PAGE + 1}'
     
     with get_db_connection() as conn:
         cursor = get_db_cursor(conn)
         
-        count_query = f"SELECT COUNT(*) as total FROM ({query}) as count_query"
-        cursor.execute(count_query, params)
-        total_bookings = cursor.fetchone()['total']
-        total_pages = (total_bookings + ITEMS_PER_PAGE - 1) // ITEMS_PER_PAGE
-        
-        if sort_by == 'newest':
-            query += ' ORDER BY b.created_at DESC'
-        elif sort_by == 'oldest':
-            query += ' ORDER BY b.created_at ASC'
-        elif sort_by == 'start_date':
-            query += ' ORDER BY b.start_date DESC'
-        elif sort_by == 'customer':
-            query += ' ORDER BY b.customer_name ASC'
-        
-        offset = (page - 1) * ITEMS_PER_PAGE
-        query += f' LIMIT {ITEMS_PER_PAGE} OFFSET {offset}'
-        
-        cursor.execute(query, params)
+        cursor.execute(page_query, page_params)
         bookings = cursor.fetchall()
         
         cursor.execute('SELECT id, name, license_plate FROM vehicles ORDER BY name')
         vehicles = cursor.fetchall()
     
-    stats = {
-        'total': total_bookings,
-        'confirmed': len([b for b in bookings if b['status'] == 'confirmed']),
-        'pending': len([b for b in bookings if b['status'] == 'pending']),
-        'cancelled': len([b for b in bookings if b['status'] == 'cancelled']),
-        'completed': len([b for b in bookings if b['status'] == 'completed'])
-    }
+    has_more = len(bookings) > ITEMS_PER_PAGE
+    bookings = bookings[:ITEMS_PER_PAGE]
+    if backwards:
+        bookings.reverse()
+    
+    # Forward walks know there is more after; backward walks know there is more before
+    has_next = has_more if not backwards else True
+    has_prev = has_more if backwards else keyset is not None
+    next_cursor = encode_cursor(sort_by, [bookings[-1][sort_column], bookings[-1]['id']]) if bookings and has_next else None
+    prev_cursor = encode_cursor(sort_by, [bookings[0][sort_column], bookings[0]['id']]) if bookings and has_prev else None
     
+    stats = get_booking_stats(request.args)
+    total_bookings = stats['total']
+    total_pages = max((total_bookings + ITEMS_PER_PAGE - 1) // ITEMS_PER_PAGE, page)
+    
+    page_args = {
+        'status': status_filter,
+        'vehicle': vehicle_filter,
+        'search': search_query,
+        'sort': sort_by,
+        'month': month_filter,
+        'show_all': '1' if show_all else '0',
+        'overlap': '1' if include_overlapping else '0',
+    }
     return render_template('admin_all_bookings.html',
                          bookings=bookings,
                          vehicles=vehicles,
@@ -1080,60 +3629,602 @@ def admin_all_bookings():
                          current_sort=sort_by,
                          current_month=month_filter,
                          show_all=show_all,
+                         include_overlapping=include_overlapping,
                          page=page,
                          total_pages=total_pages,
-                         total_bookings=total_bookings)
+                         total_bookings=total_bookings,
+                         next_cursor=next_cursor,
+                         prev_cursor=prev_cursor,
+                         page_args=page_args)
+
+
+PRINT_REPORT_FETCH_SIZE = 500
+PRINT_REPORT_FLUSH_BYTES = 16 * 1024
+
+
+def group_report_rows(bookings, group_by_vehicle=False):
+    """Tag streamed bookings for the print template, adding per-vehicle headers and subtotals.
+
+    Expects rows ordered by vehicle when grouping; only the running subtotal is kept in memory.
+    """
+    if not group_by_vehicle:
+        for booking in bookings:
+            yield 'booking', booking
+        return
+    
+    current = None
+    subtotal = None
+    for booking in bookings:
+        if current != booking['vehicle_id']:
+            if current is not None:
+                yield 'subtotal', subtotal
+            current = booking['vehicle_id']
+            subtotal = {'vehicle_name': booking['vehicle_name'], 'count': 0, 'revenue': 0}
+            yield 'group', booking
+        subtotal['count'] += 1
+        if booking['status'] != 'cancelled':
+            subtotal['revenue'] += booking['total_price'] or 0
+        yield 'booking', booking
+    if current is not None:
+        yield 'subtotal', subtotal
+
+
+def buffered_stream(chunks, flush_bytes):
+    """Coalesce the many small fragments Jinja emits into larger writes"""
+    buffer = []
+    size = 0
+    for chunk in chunks:
+        buffer.append(chunk)
+        size += len(chunk)
+        if size >= flush_bytes:
+            yield ''.join(buffer)
+            buffer = []
+            size = 0
+    if buffer:
+        yield ''.join(buffer)
 
 
 @app.route('/admin/bookings/print')
 @login_required
 def print_bookings_report():
-    """Print report"""
-    status_filter = request.args.get('status', 'all')
-    vehicle_filter = request.args.get('vehicle', 'all')
+    """Print report, streamed straight from a server-side cursor"""
+    month_filter = selected_month(request.args)
+    group_by_vehicle = request.args.get('group') == 'vehicle'
+    
+    if group_by_vehicle:
+        order_by = 'v.name, b.vehicle_id, b.created_at DESC, b.id DESC'
+    else:
+        order_by = 'b.created_at DESC, b.id DESC'
+    bookings = iter_filtered_bookings(request.args, order_by, fetch_size=PRINT_REPORT_FETCH_SIZE)
     
-    current_month = datetime.now().strftime('%Y-%m')
-    month_filter = request.args.get('month', current_month)
+    stats = get_booking_stats(request.args)
     
+    chunks = stream_template('print_bookings.html',
+                             rows=group_report_rows(bookings, group_by_vehicle),
+                             group_by_vehicle=group_by_vehicle,
+                             stats=stats,
+                             report_date=datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                             current_status=request.args.get('status', ''),
+                             current_month=month_filter)
+    return Response(buffered_stream(chunks, PRINT_REPORT_FLUSH_BYTES),
+                    mimetype='text/html',
+                    headers={'X-Accel-Buffering': 'no'})
+
+# --- BOOKING EXPORT ---
+
+EXPORT_FETCH_SIZE = 2000     # rows per round trip from the server-side cursor
+EXPORT_FLUSH_BYTES = 64 * 1024
+CSV_FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')  # cells Excel would evaluate as formulas
+
+EXPORT_COLUMNS = [
+    ('booking_number', 'Booking Number'),
+    ('created_at', 'Created'),
+    ('customer_name', 'Customer'),
+    ('ic_number', 'IC Number'),
+    ('nationality', 'Nationality'),
+    ('vehicle_name', 'Vehicle'),
+    ('license_plate', 'License Plate'),
+    ('vehicle_type', 'Vehicle Type'),
+    ('location', 'Location'),
+    ('destination', 'Destination'),
+    ('start_date', 'Start Date'),
+    ('pickup_time', 'Pickup Time'),
+    ('end_date', 'End Date'),
+    ('return_time', 'Return Time'),
+    ('total_price', 'Total Price'),
+    ('status', 'Status'),
+]
+
+
+def iter_filtered_bookings(args, order_by='b.created_at DESC, b.id DESC', fetch_size=EXPORT_FETCH_SIZE):
+    """Yield bookings matching the admin filters from a named (server-side) cursor.
+
+    Rows arrive `fetch_size` at a time, so memory stays flat however many bookings match.
+    Meant to be consumed inside stream_with_context so the request connection outlives the view.
+    """
+    where, params = build_bookings_filter(args)
     query = '''
         SELECT b.*, v.name as vehicle_name, v.license_plate, v.type as vehicle_type
         FROM bookings b
         JOIN vehicles v ON b.vehicle_id = v.id
-        WHERE SUBSTRING(b.start_date FROM 1 FOR 7) = %s
-    '''
-    params = [month_filter]
+    ''' + where + ' ORDER BY ' + order_by
     
-    if status_filter != 'all':
-        query += ' AND b.status = %s'
-        params.append(status_filter)
+    with get_db_connection() as conn:
+        cursor = conn.cursor(name='bookings_stream', cursor_factory=RealDictCursor)
+        cursor.itersize = fetch_size
+        try:
+            cursor.execute(query, params)
+            for row in cursor:
+                yield row
+        finally:
+            cursor.close()
+
+
+def export_value(value, csv_cell=False):
+    """Plain cell value for exports (dates as ISO text, None as empty).
+
+    With csv_cell, text that Excel would evaluate as a formula (=, +, -, @ ...) gets a leading
+    apostrophe; XLSX cells are written as inline strings and never need it.
+    """
+    if value is None:
+        return ''
+    if isinstance(value, datetime):
+        return value.strftime('%Y-%m-%d %H:%M:%S')
+    if csv_cell and isinstance(value, str) and value.startswith(CSV_FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+
+def stream_bookings_csv(rows):
+    """Encode rows as CSV, yielding ~64KB chunks"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    buffer.write('\ufeff')  # BOM so Excel opens UTF-8 names correctly
+    writer.writerow([label for _, label in EXPORT_COLUMNS])
+    for row in rows:
+        writer.writerow([export_value(row.get(key), csv_cell=True) for key, _ in EXPORT_COLUMNS])
+        if buffer.tell() >= EXPORT_FLUSH_BYTES:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode('utf-8')
+
+
+class _ZipStreamSink:
+    """Write-only file object for ZipFile; the generator drains it as the archive grows"""
+
+    def __init__(self):
+        self.chunks = []
+        self.size = 0
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.size += len(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        self.size = 0
+        return data
+
+
+XLSX_STATIC_PARTS = [
+    ('[Content_Types].xml',
+     '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+     '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+     '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+     '<Default Extension="xml" ContentType="application/xml"/>'
+     '<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+     '<Override PartName="/xl/worksheets/sheet1.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+     '</Types>'),
+    ('_rels/.rels',
+     '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+     '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+     '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="xl/workbook.xml"/>'
+     '</Relationships>'),
+    ('xl/workbook.xml',
+     '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+     '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+     'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+     '<sheets><sheet name="Bookings" sheetId="1" r:id="rId1"/></sheets>'
+     '</workbook>'),
+    ('xl/_rels/workbook.xml.rels',
+     '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+     '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+     '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" Target="worksheets/sheet1.xml"/>'
+     '</Relationships>'),
+]
+
+# Control characters other than tab/newline are not allowed in XML text
+XML_ILLEGAL_CHARS = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+
+def xlsx_cell(value):
+    """One <c> element; numbers stay numeric, everything else is an inline string"""
+    if isinstance(value, bool) or not isinstance(value, (int, float, Decimal)):
+        text = XML_ILLEGAL_CHARS.sub('', str(export_value(value)))
+        return f'<c t="inlineStr"><is><t xml:space="preserve">{xml_escape(text)}</t></is></c>'
+    return f'<c><v>{value}</v></c>'
+
+
+def xlsx_row(number, values):
+    return f'<row r="{number}">' + ''.join(xlsx_cell(v) for v in values) + '</row>'
+
+
+def stream_bookings_xlsx(rows):
+    """Encode rows as a single-sheet XLSX workbook, streamed as the zip is written.
+
+    The worksheet uses inline strings so no shared-string table has to be held in memory;
+    ZipFile falls back to data descriptors because the sink is not seekable.
+    """
+    sink = _ZipStreamSink()
+    archive = zipfile.ZipFile(sink, 'w', zipfile.ZIP_DEFLATED)
+    for name, xml in XLSX_STATIC_PARTS:
+        archive.writestr(name, xml)
+    yield sink.drain()
+    
+    with archive.open('xl/worksheets/sheet1.xml', 'w', force_zip64=True) as sheet:
+        sheet.write(b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                    b'<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+                    b'<sheetData>')
+        sheet.write(xlsx_row(1, [label for _, label in EXPORT_COLUMNS]).encode('utf-8'))
+        for number, row in enumerate(rows, start=2):
+            sheet.write(xlsx_row(number, [row.get(key) for key, _ in EXPORT_COLUMNS]).encode('utf-8'))
+            if sink.size >= EXPORT_FLUSH_BYTES:
+                yield sink.drain()
+        sheet.write(b'</sheetData></worksheet>')
+    archive.close()
+    yield sink.drain()
+
+
+EXPORT_FORMATS = {
+    'csv': (stream_bookings_csv, 'text/csv; charset=utf-8'),
+    'xlsx': (stream_bookings_xlsx, 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'),
+}
+
+
+@app.route('/admin/bookings/export')
+@login_required
+def export_bookings():
+    """Download every booking matching the current filters as CSV or XLSX"""
+    export_format = request.args.get('format', 'csv')
+    if export_format not in EXPORT_FORMATS:
+        export_format = 'csv'
+    encoder, mimetype = EXPORT_FORMATS[export_format]
+    
+    sort_by = request.args.get('sort', 'newest')
+    sort_column, direction = BOOKING_SORTS.get(sort_by, BOOKING_SORTS['newest'])
+    order_by = f'b.{sort_column} {direction}, b.id {direction}'
     
-    if vehicle_filter != 'all':
+    rows = iter_filtered_bookings(request.args, order_by)
+    filename = f"bookings_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{export_format}"
+    return Response(stream_with_context(encoder(rows)),
+                    mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename="{filename}"',
+                             'X-Accel-Buffering': 'no'})
+
+
+# --- REVENUE ROLLUPS ---
+
+def backfill_booking_rollups(cursor):
+    """Rebuild the rollup tables from every booking; returns the number of bookings applied.
+
+    Bookings are share-locked for the duration so no trigger delta lands between the
+    truncate and the rebuild.
+    """
+    cursor.execute("LOCK TABLE bookings IN SHARE MODE")
+    cursor.execute("TRUNCATE booking_rollup_daily, booking_rollup_monthly")
+    cursor.execute('''
+        SELECT booking_rollup_apply(vehicle_id, status, total_price, rental_period, created_at, 1)
+        FROM bookings
+    ''')
+    return cursor.rowcount
+
+
+@app.cli.command('backfill-rollups')
+def backfill_rollups_command():
+    """Rebuild daily/monthly booking rollups from history"""
+    with get_db_connection() as conn:
+        count = backfill_booking_rollups(get_db_cursor(conn))
+    print(f"✅ Booking rollups rebuilt from {count} bookings")
+
+
+# period -> (table, date column, bucket expression, label format)
+ROLLUP_PERIODS = {
+    'day': ('booking_rollup_daily', 'day', 'r.day', 'YYYY-MM-DD'),
+    'month': ('booking_rollup_monthly', 'month', 'r.month', 'YYYY-MM'),
+    'year': ('booking_rollup_monthly', 'month', "date_trunc('year', r.month)", 'YYYY'),
+}
+ROLLUP_GROUPS = {
+    'none': "''",
+    'vehicle': "COALESCE(v.name || ' · ' || v.license_plate, v.name, 'Vehicle #' || r.vehicle_id)",
+    'category': "COALESCE(r.category, 'Uncategorized')",
+    'status': 'r.status',
+}
+ROLLUP_MAX_DAYS = 366
+
+
+def parse_report_bound(value, inclusive_end=False):
+    """Parse YYYY, YYYY-MM or YYYY-MM-DD; an inclusive end moves past the whole unit"""
+    for fmt, step in (('%Y-%m-%d', 'day'), ('%Y-%m', 'month'), ('%Y', 'year')):
         try:
-            query += ' AND b.vehicle_id = %s'
-            params.append(int(vehicle_filter))
-        except:
-            pass
+            bound = datetime.strptime(value, fmt)
+        except (TypeError, ValueError):
+            continue
+        if not inclusive_end:
+            return bound
+        if step == 'day':
+            return bound + timedelta(days=1)
+        if step == 'month':
+            return month_bounds(bound.year, bound.month)[1]
+        return bound.replace(year=bound.year + 1)
+    return None
+
+
+def get_revenue_report(args):
+    """Bookings, revenue and rented half-days per period, read only from the rollup tables"""
+    period = args.get('period', 'month')
+    if period not in ROLLUP_PERIODS:
+        period = 'month'
+    group_by = args.get('group_by', 'none')
+    if group_by not in ROLLUP_GROUPS:
+        group_by = 'none'
+    status_filter = args.get('status', '')
+    
+    today = datetime.now()
+    if period == 'day':
+        default_start, default_end = month_bounds(today.year, today.month)
+    elif period == 'month':
+        default_start, default_end = datetime(today.year, 1, 1), datetime(today.year + 1, 1, 1)
+    else:
+        default_start, default_end = datetime(today.year - 4, 1, 1), datetime(today.year + 1, 1, 1)
+    start = parse_report_bound(args.get('start')) or default_start
+    end = parse_report_bound(args.get('end'), inclusive_end=True) or default_end
+    if end <= start:
+        end = default_end if default_end > start else start + timedelta(days=1)
+    if period == 'day' and (end - start).days > ROLLUP_MAX_DAYS:
+        end = start + timedelta(days=ROLLUP_MAX_DAYS)
     
-    query += ' ORDER BY b.created_at DESC LIMIT 500'
+    table, column, bucket, label_format = ROLLUP_PERIODS[period]
+    where = f' WHERE r.{column} >= %s AND r.{column} < %s'
+    params = [start.date(), end.date()]
+    if status_filter == '':
+        where += " AND r.status != 'cancelled'"
+    elif status_filter in BOOKING_STATUSES:
+        where += ' AND r.status = %s'
+        params.append(status_filter)
     
     with get_db_connection() as conn:
         cursor = get_db_cursor(conn)
-        cursor.execute(query, params)
-        bookings = cursor.fetchall()
+        cursor.execute(f'''
+            SELECT to_char({bucket}, '{label_format}') AS period,
+                   {ROLLUP_GROUPS[group_by]} AS label,
+                   SUM(r.bookings) AS bookings,
+                   SUM(r.revenue) AS revenue,
+                   SUM(r.half_days) AS half_days
+            FROM {table} r
+            LEFT JOIN vehicles v ON v.id = r.vehicle_id
+        ''' + where + '''
+            GROUP BY 1, 2
+            HAVING SUM(r.bookings) <> 0 OR SUM(r.half_days) <> 0
+            ORDER BY 1, 2
+        ''', params)
+        rows = [{'period': row['period'],
+                 'label': row['label'],
+                 'bookings': int(row['bookings']),
+                 'revenue': float(row['revenue']),
+                 'half_days': int(row['half_days'])} for row in cursor.fetchall()]
     
-    stats = {
-        'total': len(bookings),
-        'confirmed': len([b for b in bookings if b['status'] == 'confirmed']),
-        'pending': len([b for b in bookings if b['status'] == 'pending']),
-        'cancelled': len([b for b in bookings if b['status'] == 'cancelled']),
-        'completed': len([b for b in bookings if b['status'] == 'completed'])
+    return {
+        'period': period,
+        'group_by': group_by,
+        'status': status_filter,
+        'start': start.strftime('%Y-%m-%d'),
+        'end': end.strftime('%Y-%m-%d'),
+        'rows': rows,
+        'totals': {
+            'bookings': sum(row['bookings'] for row in rows),
+            'revenue': round(sum(row['revenue'] for row in rows), 2),
+            'half_days': sum(row['half_days'] for row in rows),
+        },
     }
+
+
+@app.route('/admin/reports/revenue')
+@login_required
+def admin_revenue_report():
+    """Revenue dashboard; ?format=json returns the same report for other tools"""
+    report = get_revenue_report(request.args)
+    if request.args.get('format') == 'json':
+        return jsonify(report)
     
-    return render_template('print_bookings.html', 
-                         bookings=bookings,
-                         stats=stats,
-                         report_date=datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-                         current_month=month_filter)
+    max_revenue = max((row['revenue'] for row in report['rows']), default=0)
+    return render_template('admin_revenue.html',
+                         report=report,
+                         max_revenue=max_revenue,
+                         periods=list(ROLLUP_PERIODS),
+                         groups=list(ROLLUP_GROUPS),
+                         statuses=BOOKING_STATUSES,
+                         current_start=request.args.get('start', ''),
+                         current_end=request.args.get('end', ''))
+
+
+# --- UPLOAD ROUTES ---
+@app.route('/uploads/jobs/<int:job_id>')
+@login_required
+def image_job_status(job_id):
+    """Processing status of a background image upload"""
+    with get_db_connection() as conn:
+        cursor = get_db_cursor(conn)
+        cursor.execute('''SELECT id, kind, target_id, status, image_url, error, created_at, finished_at
+            FROM image_jobs WHERE id = %s''', (job_id,))
+        job = cursor.fetchone()
+    
+    if not job:
+        return jsonify({'success': False, 'message': 'Image job not found'}), 404
+    return jsonify({'success': True, 'job': job})
+
+
+@app.route('/uploads/jobs/<int:job_id>/image')
+def image_job_image(job_id):
+    """Placeholder image URL for a pending upload; redirects to the real file once published"""
+    with get_db_connection() as conn:
+        cursor = get_db_cursor(conn)
+        cursor.execute('SELECT kind, status, image_url, replaces_url FROM image_jobs WHERE id = %s', (job_id,))
+        job = cursor.fetchone()
+    
+    if not job or (job['kind'] == 'customer' and not session.get('admin_logged_in')):
+        return render_template('404.html'), 404
+    if job['status'] == 'done':
+        return redirect(job['image_url'])
+    if job['status'] == 'failed' and job['replaces_url']:
+        return redirect(job['replaces_url'])
+    
+    response = Response(IMAGE_PLACEHOLDER_SVG, mimetype='image/svg+xml')
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+
+@app.route('/uploads/files/<path:key>')
+@login_required
+def private_upload(key):
+    """Private upload (customer photos): redirect to a short-lived URL served by the storage backend"""
+    # Only keys under a private target's prefix; never quarantined or other objects in the bucket
+    private_prefixes = tuple(f"{target[3]}/" for target in IMAGE_JOB_TARGETS.values() if target[4])
+    if not key.startswith(private_prefixes) or '..' in key.split('/'):
+        return render_template('404.html'), 404
+    return redirect(get_upload_storage().signed_url(key))
+
+
+@app.cli.command('process-image-jobs')
+def process_image_jobs_command():
+    """Encode image jobs left pending by a worker that stopped before finishing them"""
+    with get_db_connection() as conn:
+        cursor = get_db_cursor(conn)
+        cursor.execute('''SELECT id, kind, spool_path, filename FROM image_jobs
+            WHERE status = 'pending' AND created_at < CURRENT_TIMESTAMP - INTERVAL '10 minutes'
+            ORDER BY id''')
+        jobs = cursor.fetchall()
+    
+    for job in jobs:
+        if os.path.exists(job['spool_path']):
+            run_image_job(job)
+        else:
+            finish_image_job(job['id'], None, 'Spooled upload is missing')
+    print(f"✅ Processed {len(jobs)} pending image jobs")
+
+
+@app.cli.command('rebuild-upload-refs')
+def rebuild_upload_refs_command():
+    """Recount upload references from vehicles and bookings"""
+    with get_db_connection() as conn:
+        count = backfill_upload_refs(get_db_cursor(conn))
+    print(f"✅ Upload references rebuilt for {count} stored files")
+
+
+@app.cli.command('build-image-variants')
+def build_image_variants_command():
+    """Generate responsive variants for vehicle images uploaded before they existed"""
+    with get_db_connection() as conn:
+        cursor = get_db_cursor(conn)
+        cursor.execute('''SELECT id, image_url FROM vehicles
+            WHERE image_variants IS NULL AND image_url <> '' AND image_url NOT LIKE '/uploads/jobs/%'
+            ORDER BY id''')
+        vehicles = cursor.fetchall()
+        
+        storage = get_upload_storage()
+        built = 0
+        for vehicle in vehicles:
+            key = storage.key_for_url(vehicle['image_url'])
+            if not key:
+                continue
+            try:
+                with Image.open(io.BytesIO(storage.read(key))) as img:
+                    save_image_variants(img.convert('RGB'), key)
+            except Exception as e:
+                print(f"⚠️  Skipped vehicle {vehicle['id']}: {e}")
+                continue
+            variants = image_variant_srcsets(key)
+            if variants:
+                cursor.execute('UPDATE vehicles SET image_variants = %s WHERE id = %s AND image_url = %s',
+                               (Json(variants), vehicle['id'], vehicle['image_url']))
+                built += 1
+    
+    on_vehicles_changed()
+    print(f"✅ Built image variants for {built} of {len(vehicles)} vehicles")
+
+
+def format_bytes(size):
+    """Human-readable byte count for CLI output"""
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if size < 1024 or unit == 'GB':
+            return f"{size:.0f} {unit}" if unit == 'B' else f"{size:.1f} {unit}"
+        size /= 1024
+
+
+@app.cli.command('gc-uploads')
+@click.option('--grace-hours', type=float, default=UPLOAD_GC_GRACE_HOURS, show_default=True,
+              help='Leave unreferenced files younger than this alone')
+@click.option('--quarantine', 'action', flag_value='quarantine', default=True,
+              help=f'Move orphans to quarantine, purged after {UPLOAD_QUARANTINE_DAYS:g} days (default)')
+@click.option('--delete', 'action', flag_value='delete', help='Delete orphans instead of quarantining them')
+@click.option('--dry-run', 'action', flag_value='report', help='Only report usage and what would be reclaimed')
+def gc_uploads_command(grace_hours, action):
+    """Quarantine stored uploads no vehicle or booking references (run daily, e.g. from cron)"""
+    result = collect_upload_garbage(grace_hours, action=None if action == 'report' else action)
+    with get_db_connection() as conn:
+        get_db_cursor(conn).execute('''INSERT INTO upload_gc_state (id, report) VALUES (1, %s)
+            ON CONFLICT (id) DO UPDATE SET report = EXCLUDED.report, finished_at = CURRENT_TIMESTAMP''',
+            (Json(result),))
+    for folder, usage in sorted(result['folders'].items()):
+        print(f"📁 {folder}: {usage['files']} files, {format_bytes(usage['bytes'])}")
+    quarantine = result['quarantine']
+    print(f"📁 quarantine: {quarantine['files']} files, {format_bytes(quarantine['bytes'])}")
+    
+    reclaimed, spool = result['reclaimed'], result['spool']
+    verb = {'quarantine': 'Quarantined', 'delete': 'Deleted', None: 'Would reclaim'}[result['action']]
+    print(f"✅ {verb} {reclaimed['files']} orphaned files ({format_bytes(reclaimed['bytes'])}), "
+          f"{spool['files']} stale spool files ({format_bytes(spool['bytes'])})")
+    if quarantine['purged_files']:
+        print(f"✅ Purged {quarantine['purged_files']} quarantined files ({format_bytes(quarantine['purged_bytes'])}) "
+              f"older than {UPLOAD_QUARANTINE_DAYS:g} days")
+    if result['recent']['files']:
+        print(f"⚠️  Kept {result['recent']['files']} unreferenced files younger than {grace_hours:g}h")
+
+
+# --- SYSTEM MONITORING ---
+@app.route('/admin/system/db-pool')
+@login_required
+def admin_db_pool_stats():
+    """Connection pool stats for this worker process"""
+    return jsonify(get_db_pool().stats())
+
+
+@app.route('/admin/system/booking-index')
+@login_required
+def admin_booking_index_stats():
+    """In-memory booking index state for this worker process"""
+    return jsonify(booking_index.stats())
+
+
+@app.route('/admin/system/storage')
+@login_required
+def admin_storage_usage():
+    """Upload storage usage per folder from the last gc-uploads run.
+
+    Collecting is a walk of every stored file, so it is left to the CLI (cron) rather than a request.
+    """
+    with get_db_connection() as conn:
+        cursor = get_db_cursor(conn)
+        cursor.execute("SELECT report, finished_at FROM upload_gc_state WHERE id = 1")
+        state = cursor.fetchone()
+    if not state:
+        return jsonify({'success': False, 'message': 'No storage report yet - run flask gc-uploads'}), 404
+    return jsonify({**state['report'], 'finished_at': state['finished_at'].isoformat(timespec='seconds')})
 
 
 # --- ERROR HANDLERS ---
@@ -28,6 +28,7 @@ CREATE TABLE IF NOT EXISTS vehicles (
     price_weekly INTEGER NOT NULL,
     price_monthly INTEGER NOT NULL,
     image_url TEXT,
+    image_variants JSONB,  -- {format: srcset} for responsive derivatives of image_url
     terms_and_conditions TEXT,
     is_active INTEGER DEFAULT 1,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
@@ -51,12 +52,19 @@ CREATE TABLE IF NOT EXISTS bookings (
     total_price DECIMAL(10,2),
     status VARCHAR(50) DEFAULT 'pending',
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    rental_period TSRANGE,  -- maintained by trg_bookings_rental_period
     CONSTRAINT fk_vehicle
         FOREIGN KEY (vehicle_id) 
         REFERENCES vehicles(id)
         ON DELETE CASCADE
 );
 
+-- Per-day booking number counter (VR-YYYYMMDD-XXXX)
+CREATE TABLE IF NOT EXISTS booking_counters (
+    day DATE PRIMARY KEY,
+    last_value INTEGER NOT NULL
+);
+
 -- =====================================================
 -- STEP 2: Create Indexes for Performance
 -- =====================================================
@@ -73,8 +81,39 @@ CREATE INDEX IF NOT EXISTS idx_bookings_created
 CREATE INDEX IF NOT EXISTS idx_bookings_dates 
     ON bookings(start_date, end_date);
 
-CREATE INDEX IF NOT EXISTS idx_bookings_month 
-    ON bookings(SUBSTRING(start_date FROM 1 FOR 7));
+-- Trigram indexes: ILIKE '%term%' and typo-tolerant (<%) search
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE INDEX IF NOT EXISTS idx_bookings_number_trgm 
+    ON bookings USING gin (booking_number gin_trgm_ops);
+
+CREATE INDEX IF NOT EXISTS idx_bookings_customer_trgm 
+    ON bookings USING gin (customer_name gin_trgm_ops);
+
+CREATE INDEX IF NOT EXISTS idx_bookings_ic_trgm 
+    ON bookings USING gin (ic_number gin_trgm_ops);
+
+CREATE INDEX IF NOT EXISTS idx_vehicles_name_trgm 
+    ON vehicles USING gin (name gin_trgm_ops);
+
+CREATE INDEX IF NOT EXISTS idx_vehicles_plate_trgm 
+    ON vehicles USING gin (license_plate gin_trgm_ops);
+
+CREATE INDEX IF NOT EXISTS idx_vehicles_type_trgm 
+    ON vehicles USING gin (type gin_trgm_ops);
+
+CREATE INDEX IF NOT EXISTS idx_vehicles_cc_trgm 
+    ON vehicles USING gin ((cc::TEXT) gin_trgm_ops);
+
+-- Keyset pagination on /admin/bookings (sort key + id tie-break)
+CREATE INDEX IF NOT EXISTS idx_bookings_created_id 
+    ON bookings(created_at, id);
+
+CREATE INDEX IF NOT EXISTS idx_bookings_start_id 
+    ON bookings(start_date, id);
+
+CREATE INDEX IF NOT EXISTS idx_bookings_customer_id 
+    ON bookings(customer_name, id);
 
 CREATE INDEX IF NOT EXISTS idx_vehicles_category 
     ON vehicles(category);
@@ -82,6 +121,403 @@ CREATE INDEX IF NOT EXISTS idx_vehicles_category
 CREATE INDEX IF NOT EXISTS idx_vehicles_active 
     ON vehicles(is_active);
 
+-- =====================================================
+-- STEP 2b: Typed Rental Period
+-- =====================================================
+
+-- rental_period = [start_date pickup_time, end_date return_time) as TSRANGE,
+-- derived from the VARCHAR columns so availability queries can use GiST
+
+CREATE OR REPLACE FUNCTION booking_period(p_start_date TEXT, p_pickup_time TEXT,
+                                          p_end_date TEXT, p_return_time TEXT)
+RETURNS TSRANGE AS $$
+DECLARE
+    v_start TIMESTAMP;
+    v_end TIMESTAMP;
+BEGIN
+    -- Malformed dates/times raise (invalid_datetime_format) rather than leaving the period NULL,
+    -- which would slip past bookings_no_overlap and every rental_period query
+    v_start := (p_start_date || ' ' || p_pickup_time)::timestamp;
+    v_end := (p_end_date || ' ' || p_return_time)::timestamp;
+    -- A zero-length period is an empty range, which && and lower() never match
+    IF v_end <= v_start THEN
+        RAISE EXCEPTION 'bookings_valid_period: return % is not after pickup %', v_end, v_start
+            USING ERRCODE = 'check_violation';
+    END IF;
+    RETURN tsrange(v_start, v_end, '[)');
+END;
+$$ LANGUAGE plpgsql STABLE;
+
+CREATE OR REPLACE FUNCTION bookings_set_rental_period() RETURNS TRIGGER AS $$
+BEGIN
+    NEW.rental_period := booking_period(NEW.start_date, NEW.pickup_time,
+                                        NEW.end_date, NEW.return_time);
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_bookings_rental_period ON bookings;
+CREATE TRIGGER trg_bookings_rental_period
+    BEFORE INSERT OR UPDATE OF start_date, pickup_time, end_date, return_time ON bookings
+    FOR EACH ROW EXECUTE FUNCTION bookings_set_rental_period();
+
+-- Change log replayed by each app worker's in-memory booking index
+CREATE TABLE IF NOT EXISTS booking_changes (
+    seq BIGSERIAL PRIMARY KEY,
+    booking_id INTEGER NOT NULL,
+    changed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS idx_booking_changes_changed ON booking_changes(changed_at);
+
+CREATE OR REPLACE FUNCTION bookings_log_change() RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        INSERT INTO booking_changes (booking_id) VALUES (OLD.id);
+        RETURN OLD;
+    END IF;
+    INSERT INTO booking_changes (booking_id) VALUES (NEW.id);
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_bookings_log_change ON bookings;
+CREATE TRIGGER trg_bookings_log_change
+    AFTER INSERT OR UPDATE OR DELETE ON bookings
+    FOR EACH ROW EXECUTE FUNCTION bookings_log_change();
+
+-- Month filters: lower(rental_period) >= month_start AND < next_month
+CREATE INDEX IF NOT EXISTS idx_bookings_period_start 
+    ON bookings (lower(rental_period));
+
+-- Legacy bookings whose dates never parsed (no rental_period) are matched on start_date LIKE 'YYYY-MM%'
+CREATE INDEX IF NOT EXISTS idx_bookings_unparsed_start
+    ON bookings (start_date text_pattern_ops) WHERE rental_period IS NULL;
+
+-- Reject overlapping non-cancelled bookings for the same vehicle
+-- (the constraint's GiST index on (vehicle_id, rental_period) serves availability lookups)
+CREATE EXTENSION IF NOT EXISTS btree_gist;
+
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'bookings_no_overlap') THEN
+        ALTER TABLE bookings ADD CONSTRAINT bookings_no_overlap
+            EXCLUDE USING gist (vehicle_id WITH =, rental_period WITH &&)
+            WHERE (status != 'cancelled');
+    END IF;
+END $$;
+
+-- =====================================================
+-- STEP 2c: Reporting Rollups
+-- =====================================================
+
+-- Daily/monthly booking counts, revenue and rented half-days per vehicle and status,
+-- kept current by triggers. Rebuild from history with: flask --app app backfill-rollups
+
+CREATE TABLE IF NOT EXISTS booking_rollup_daily (
+    day DATE NOT NULL,
+    vehicle_id INTEGER NOT NULL,
+    category VARCHAR(50),
+    status VARCHAR(50) NOT NULL,
+    bookings INTEGER NOT NULL DEFAULT 0,
+    revenue DECIMAL(12,2) NOT NULL DEFAULT 0,
+    half_days INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (day, vehicle_id, status)
+);
+
+CREATE TABLE IF NOT EXISTS booking_rollup_monthly (
+    month DATE NOT NULL,
+    vehicle_id INTEGER NOT NULL,
+    category VARCHAR(50),
+    status VARCHAR(50) NOT NULL,
+    bookings INTEGER NOT NULL DEFAULT 0,
+    revenue DECIMAL(12,2) NOT NULL DEFAULT 0,
+    half_days INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (month, vehicle_id, status)
+);
+
+-- Add (p_sign = 1) or remove (p_sign = -1) one booking's contribution.
+-- The booking and its revenue count on the pickup day; rented half-days are spread
+-- over the days it covers (pickup and return day one half each, days between two).
+CREATE OR REPLACE FUNCTION booking_rollup_apply(p_vehicle_id INTEGER, p_status TEXT,
+                                                p_total NUMERIC, p_period TSRANGE,
+                                                p_created TIMESTAMP, p_sign INTEGER)
+RETURNS VOID AS $$
+DECLARE
+    v_category VARCHAR(50);
+    v_first DATE := lower(p_period)::date;
+    v_last DATE := upper(p_period)::date;
+BEGIN
+    SELECT category INTO v_category FROM vehicles WHERE id = p_vehicle_id;
+
+    WITH contributions AS (
+        SELECT COALESCE(v_first, p_created::date, CURRENT_DATE) AS day,
+               1 AS bookings, COALESCE(p_total, 0) AS revenue, 0 AS half_days
+        UNION ALL
+        SELECT d::date, 0, 0,
+               CASE WHEN v_first = v_last OR d::date IN (v_first, v_last) THEN 1 ELSE 2 END
+        FROM generate_series(v_first, v_last, interval '1 day') d
+        WHERE p_period IS NOT NULL
+    ), per_day AS (
+        SELECT day, SUM(bookings) * p_sign AS bookings, SUM(revenue) * p_sign AS revenue,
+               SUM(half_days) * p_sign AS half_days
+        FROM contributions
+        GROUP BY day
+    ), daily AS (
+        INSERT INTO booking_rollup_daily AS r
+            (day, vehicle_id, category, status, bookings, revenue, half_days)
+        SELECT day, p_vehicle_id, v_category, p_status, bookings, revenue, half_days
+        FROM per_day
+        ON CONFLICT (day, vehicle_id, status) DO UPDATE SET
+            bookings = r.bookings + EXCLUDED.bookings,
+            revenue = r.revenue + EXCLUDED.revenue,
+            half_days = r.half_days + EXCLUDED.half_days
+    )
+    INSERT INTO booking_rollup_monthly AS r
+        (month, vehicle_id, category, status, bookings, revenue, half_days)
+    SELECT date_trunc('month', day)::date, p_vehicle_id, v_category, p_status,
+           SUM(bookings), SUM(revenue), SUM(half_days)
+    FROM per_day
+    GROUP BY 1
+    ON CONFLICT (month, vehicle_id, status) DO UPDATE SET
+        bookings = r.bookings + EXCLUDED.bookings,
+        revenue = r.revenue + EXCLUDED.revenue,
+        half_days = r.half_days + EXCLUDED.half_days;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION bookings_update_rollups() RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM booking_rollup_apply(OLD.vehicle_id, OLD.status, OLD.total_price,
+                                     OLD.rental_period, OLD.created_at, -1);
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        PERFORM booking_rollup_apply(NEW.vehicle_id, NEW.status, NEW.total_price,
+                                     NEW.rental_period, NEW.created_at, 1);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_bookings_update_rollups ON bookings;
+CREATE TRIGGER trg_bookings_update_rollups
+    AFTER INSERT OR DELETE OR UPDATE OF vehicle_id, status, total_price, start_date,
+        pickup_time, end_date, return_time ON bookings
+    FOR EACH ROW EXECUTE FUNCTION bookings_update_rollups();
+
+CREATE OR REPLACE FUNCTION vehicles_update_rollup_category() RETURNS TRIGGER AS $$
+BEGIN
+    UPDATE booking_rollup_daily SET category = NEW.category WHERE vehicle_id = NEW.id;
+    UPDATE booking_rollup_monthly SET category = NEW.category WHERE vehicle_id = NEW.id;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_vehicles_rollup_category ON vehicles;
+CREATE TRIGGER trg_vehicles_rollup_category
+    AFTER UPDATE OF category ON vehicles
+    FOR EACH ROW WHEN (OLD.category IS DISTINCT FROM NEW.category)
+    EXECUTE FUNCTION vehicles_update_rollup_category();
+
+-- =====================================================
+-- STEP 2d: Half-Day Slot Bitmaps
+-- =====================================================
+
+-- One BIGINT per vehicle per month, 2 bits per day (morning, afternoon), recomputed by
+-- trigger on booking writes. Rebuild with: flask --app app rebuild-slot-bitmaps
+
+CREATE TABLE IF NOT EXISTS vehicle_slot_bitmaps (
+    vehicle_id INTEGER NOT NULL,
+    month DATE NOT NULL,
+    slots BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (vehicle_id, month)
+);
+
+-- Bits 2d and 2d+1 are the morning and afternoon of day d+1 of the month. The pickup
+-- and return days mark the half their time falls in; days between are marked in full.
+CREATE OR REPLACE FUNCTION booking_slot_bits(p_period TSRANGE, p_month DATE) RETURNS BIGINT AS $$
+    SELECT COALESCE(bit_or(
+        (CASE WHEN g.ts::date = lower(p_period)::date
+                  THEN CASE WHEN extract(hour FROM lower(p_period)) < 12 THEN 1 ELSE 2 END
+              WHEN g.ts::date = upper(p_period)::date
+                  THEN CASE WHEN extract(hour FROM upper(p_period)) > 12 THEN 2 ELSE 1 END
+              ELSE 3 END)::bigint << (2 * (g.ts::date - p_month))), 0)
+    FROM generate_series(GREATEST(lower(p_period)::date, p_month),
+                         LEAST(upper(p_period)::date, (p_month + interval '1 month')::date - 1),
+                         interval '1 day') AS g(ts)
+$$ LANGUAGE sql IMMUTABLE;
+
+CREATE OR REPLACE FUNCTION refresh_vehicle_slot_bitmaps(p_vehicle_id INTEGER, p_from DATE, p_to DATE)
+RETURNS VOID AS $$
+DECLARE
+    v_first DATE := date_trunc('month', p_from)::date;
+    v_last DATE := date_trunc('month', p_to)::date;
+BEGIN
+    INSERT INTO vehicle_slot_bitmaps (vehicle_id, month)
+    SELECT p_vehicle_id, m::date FROM generate_series(v_first, v_last, interval '1 month') m
+    ON CONFLICT DO NOTHING;
+
+    -- Lock before recounting so the UPDATE's snapshot includes concurrent writers' bookings
+    PERFORM 1 FROM vehicle_slot_bitmaps
+    WHERE vehicle_id = p_vehicle_id AND month BETWEEN v_first AND v_last
+    ORDER BY month
+    FOR UPDATE;
+
+    UPDATE vehicle_slot_bitmaps s SET slots = COALESCE((
+        SELECT bit_or(booking_slot_bits(b.rental_period, s.month))
+        FROM bookings b
+        WHERE b.vehicle_id = p_vehicle_id AND b.status != 'cancelled'
+          AND b.rental_period && tsrange((s.month - 1)::timestamp,
+                                         (s.month + interval '1 month')::timestamp, '[)')
+    ), 0)
+    WHERE s.vehicle_id = p_vehicle_id AND s.month BETWEEN v_first AND v_last;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION bookings_refresh_slot_bitmaps() RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.rental_period IS NOT NULL THEN
+        PERFORM refresh_vehicle_slot_bitmaps(OLD.vehicle_id, lower(OLD.rental_period)::date,
+                                             upper(OLD.rental_period)::date);
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.rental_period IS NOT NULL THEN
+        PERFORM refresh_vehicle_slot_bitmaps(NEW.vehicle_id, lower(NEW.rental_period)::date,
+                                             upper(NEW.rental_period)::date);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_bookings_refresh_slot_bitmaps ON bookings;
+CREATE TRIGGER trg_bookings_refresh_slot_bitmaps
+    AFTER INSERT OR DELETE OR UPDATE OF vehicle_id, status, start_date, pickup_time,
+        end_date, return_time ON bookings
+    FOR EACH ROW EXECUTE FUNCTION bookings_refresh_slot_bitmaps();
+
+-- =====================================================
+-- STEP 2e: Catalog Version
+-- =====================================================
+
+-- Single-row version stamp used by the app to invalidate cached catalog pages
+
+CREATE TABLE IF NOT EXISTS catalog_state (
+    id INTEGER PRIMARY KEY DEFAULT 1 CHECK (id = 1),
+    version BIGINT NOT NULL DEFAULT 1,
+    changed_at TIMESTAMP NOT NULL DEFAULT date_trunc('second', now() AT TIME ZONE 'UTC')
+);
+INSERT INTO catalog_state (id) VALUES (1) ON CONFLICT DO NOTHING;
+
+-- Any vehicle write bumps the version; changed_at (UTC, whole seconds) is the catalog's Last-Modified
+CREATE OR REPLACE FUNCTION vehicles_bump_catalog_version() RETURNS TRIGGER AS $$
+BEGIN
+    UPDATE catalog_state
+    SET version = version + 1,
+        changed_at = date_trunc('second', now() AT TIME ZONE 'UTC')
+    WHERE id = 1;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_vehicles_catalog_version ON vehicles;
+CREATE TRIGGER trg_vehicles_catalog_version
+    AFTER INSERT OR UPDATE OR DELETE ON vehicles
+    FOR EACH STATEMENT EXECUTE FUNCTION vehicles_bump_catalog_version();
+
+-- =====================================================
+-- STEP 2f: Background Image Jobs
+-- =====================================================
+
+-- Uploads waiting for (or finished with) background encoding. While pending, the target
+-- row's image column holds the job's placeholder URL; replaces_url is the file it supersedes.
+
+CREATE TABLE IF NOT EXISTS image_jobs (
+    id SERIAL PRIMARY KEY,
+    kind VARCHAR(20) NOT NULL,
+    target_id INTEGER NOT NULL,
+    spool_path TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    replaces_url TEXT,
+    status VARCHAR(20) NOT NULL DEFAULT 'pending',
+    image_url TEXT,
+    error TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    finished_at TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS idx_image_jobs_pending ON image_jobs (id) WHERE status = 'pending';
+
+-- =====================================================
+-- STEP 2g: Upload Reference Counts
+-- =====================================================
+
+-- How many vehicles/bookings point at each stored upload; files are only deleted at zero
+CREATE TABLE IF NOT EXISTS upload_objects (
+    url TEXT PRIMARY KEY,
+    refs INTEGER NOT NULL DEFAULT 0,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE OR REPLACE FUNCTION upload_ref_adjust(p_url TEXT, p_delta INTEGER) RETURNS VOID AS $$
+BEGIN
+    IF p_url IS NULL OR p_url = '' OR p_url LIKE '/uploads/jobs/%' THEN
+        RETURN;
+    END IF;
+    INSERT INTO upload_objects (url, refs) VALUES (p_url, GREATEST(p_delta, 0))
+    ON CONFLICT (url) DO UPDATE SET refs = GREATEST(upload_objects.refs + p_delta, 0);
+END;
+$$ LANGUAGE plpgsql;
+
+-- TG_ARGV[0] names the column holding the upload URL
+CREATE OR REPLACE FUNCTION upload_refs_track() RETURNS TRIGGER AS $$
+DECLARE
+    v_old TEXT;
+    v_new TEXT;
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        v_old := to_jsonb(OLD) ->> TG_ARGV[0];
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        v_new := to_jsonb(NEW) ->> TG_ARGV[0];
+    END IF;
+    IF v_old IS DISTINCT FROM v_new THEN
+        PERFORM upload_ref_adjust(v_old, -1);
+        PERFORM upload_ref_adjust(v_new, 1);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_vehicles_upload_refs ON vehicles;
+CREATE TRIGGER trg_vehicles_upload_refs
+    AFTER INSERT OR DELETE OR UPDATE OF image_url ON vehicles
+    FOR EACH ROW EXECUTE FUNCTION upload_refs_track('image_url');
+
+DROP TRIGGER IF EXISTS trg_bookings_upload_refs ON bookings;
+CREATE TRIGGER trg_bookings_upload_refs
+    AFTER INSERT OR DELETE OR UPDATE OF customer_photo ON bookings
+    FOR EACH ROW EXECUTE FUNCTION upload_refs_track('customer_photo');
+
+-- Backfill for an existing database (the app does this automatically when it creates the table)
+INSERT INTO upload_objects (url, refs)
+SELECT url, COUNT(*) FROM (
+    SELECT image_url AS url FROM vehicles
+    UNION ALL
+    SELECT customer_photo FROM bookings
+) refs
+WHERE url <> '' AND url NOT LIKE '/uploads/jobs/%'
+GROUP BY url
+ON CONFLICT (url) DO NOTHING;
+
+-- =====================================================
+-- STEP 2h: Upload Garbage Collection Report
+-- =====================================================
+
+-- Last report written by flask gc-uploads, served by /admin/system/storage
+CREATE TABLE IF NOT EXISTS upload_gc_state (
+    id INTEGER PRIMARY KEY DEFAULT 1 CHECK (id = 1),
+    report JSONB NOT NULL,
+    finished_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
 -- =====================================================
 -- STEP 3: Insert Default Admin User
 -- =====================================================